@@ -10,10 +10,15 @@ Equal Plus
 import os
 import time
 import json
+import shlex
+import base64
 import shutil
 import docker
+import fnmatch
+import hashlib
 import argparse
 import configparser
+from concurrent.futures import ThreadPoolExecutor
 
 #===============================================================================
 # Implement
@@ -43,48 +48,210 @@ health_check_interval = int(config['default']['health_check_interval'])
 health_check_timeout = int(config['default']['health_check_timeout'])
 health_check_retries = int(config['default']['health_check_retries'])
 
+stop_timeout = int(config['default']['stop_timeout'])
+
 container_links = config._sections['container:links']
 
+cluster_nodes = int(config['cluster']['nodes'])
+cluster_roles = config['cluster']['roles']
+
+snapshot_repository = config['snapshot']['repository']
+snapshot_retention = int(config['snapshot']['retention'])
+snapshot_timeout = int(config['snapshot']['timeout'])
+
 
 #===============================================================================
 # Container Control
 #===============================================================================
+# digest of build context
+def digest():
+    with open(f'{path}/.dockerignore', 'r') as fd: ignores = [line.strip() for line in fd if line.strip() and not line.startswith('#')]
+    hash = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        relative = os.path.relpath(root, path)
+        dirs[:] = sorted(name for name in dirs if not any(fnmatch.fnmatch(os.path.normpath(f'{relative}/{name}'), ignore) for ignore in ignores))
+        for name in sorted(files):
+            file = os.path.normpath(f'{relative}/{name}')
+            if any(fnmatch.fnmatch(file, ignore) for ignore in ignores): continue
+            hash.update(file.encode('utf-8') + b'\0')
+            with open(f'{path}/{file}', 'rb') as fd:
+                for chunk in iter(lambda: fd.read(1048576), b''): hash.update(chunk)
+            hash.update(b'\0')
+    return hash.hexdigest()
+
+
 # build
-def build(): client.images.build(nocache=True, rm=True, path=f'{path}', tag=f'{tenant}/{title}:{version}')
+def build(nocache=False):
+    tag = f'{tenant}/{title}:{version}'
+    context = digest()
+    if not nocache:
+        try:
+            if client.images.get(tag).labels.get('eqpls.context.digest') == context:
+                print(f'{tag} is up to date')
+                return
+        except docker.errors.ImageNotFound: pass
+    client.images.build(nocache=nocache, rm=True, path=f'{path}', tag=tag, labels={'eqpls.context.digest': context})
+
+
+# wait desire status of container
+def wait(container, since):
+    until = int(since) + health_check_interval * health_check_retries + health_check_timeout
+    events = client.events(since=int(since), until=until, decode=True, filters={
+        'container': container.id,
+        'event': ['start', 'health_status', 'die']
+    })
+    started = False
+    try:
+        for event in events:
+            # events of the second of since are replayed, so only the ones after own start count
+            if event['Action'] == 'start': started = event['timeNano'] >= int(since * 1000000000)
+            if not started: continue
+            if event['Action'] == 'die':
+                print(f'{container.name} was exited')
+                exit(1)
+            if event['Action'].split(': ')[-1] == 'healthy':
+                print(f'{container.name} is healthy')
+                return
+    finally: events.close()
+    container.reload()
+    print(f'{container.name} was not healthy in {until - int(since)}s : {container.status}')
+    exit(1)
+
+
+# bytes of docker memory notation
+def bytesize(value):
+    units = {'b': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+    value = value.strip().lower()
+    if value[-2:] in ['kb', 'mb', 'gb']: value = value[:-1]
+    return int(float(value[:-1]) * units[value[-1]]) if value[-1] in units else int(value)
+
+
+# jvm heap in megabytes, half of memory under compressed oops limit
+def heapsize(): return min(bytesize(memory) // 2, 31 * 1024 ** 3) // 1024 ** 2
+
+
+# check host kernel settings required by elasticsearch
+def preflight():
+    try:
+        with open('/proc/sys/vm/max_map_count', 'r') as fd: max_map_count = int(fd.read().strip())
+    except: return
+    if max_map_count < 262144:
+        print(f'vm.max_map_count of host is {max_map_count}, elasticsearch requires at least 262144')
+        print('run "sysctl -w vm.max_map_count=262144" and set it in /etc/sysctl.conf to keep it after reboot')
+        if cluster_nodes > 1: exit(1)
 
 
-# deploy
-def deploy(nowait=False):
-    try: os.mkdir(f'{path}/conf.d')
-    except: pass
-    try: os.mkdir(f'{path}/data.d')
-    except: pass
-    try: os.mkdir(f'{path}/back.d')
+# file realm users with system superuser, hashed as elasticsearch pbkdf2
+def realm():
+    salt = os.urandom(32)
+    key = hashlib.pbkdf2_hmac('sha512', system_secret_key.encode('utf-8'), salt, 10000, 32)
+    with open(f'{path}/conf.d/users', 'w') as fd: fd.write(f'{system_access_key}:{{PBKDF2}}10000${base64.b64encode(salt).decode()}${base64.b64encode(key).decode()}\n')
+    with open(f'{path}/conf.d/users_roles', 'w') as fd: fd.write(f'superuser:{system_access_key}\n')
+
+
+# roles of cluster node
+def roles(index): return config['cluster'].get(f'roles.{index}', cluster_roles).replace(' ', '')
+
+
+# certificates of cluster nodes signed by one ca
+def certificates():
+    if os.path.isfile(f'{path}/conf.d/certs/ca/ca.crt'): return
+    try: os.makedirs(f'{path}/conf.d/certs')
     except: pass
+    with open(f'{path}/conf.d/certs/instances.yml', 'w') as fd:
+        fd.write('instances:\n')
+        for index in range(1, cluster_nodes + 1): fd.write(f'  - name: {hostname}-{index}\n    dns: [{hostname}-{index}, localhost]\n    ip: [127.0.0.1]\n')
+    client.containers.run(
+        f'{tenant}/{title}:{version}',
+        remove=True,
+        user='0',
+        entrypoint=['bash', '-c', ' && '.join([
+            'bin/elasticsearch-certutil ca --silent --pem --out config/certs/ca.zip',
+            'unzip -o config/certs/ca.zip -d config/certs',
+            'bin/elasticsearch-certutil cert --silent --pem --in config/certs/instances.yml --ca-cert config/certs/ca/ca.crt --ca-key config/certs/ca/ca.key --out config/certs/certs.zip',
+            'unzip -o config/certs/certs.zip -d config/certs',
+            'rm -f config/certs/*.zip',
+            'chown -R 1000:0 config/certs'
+        ])],
+        volumes=[
+            f'{path}/conf.d/certs:/usr/share/elasticsearch/config/certs'
+        ]
+    )
 
-    ports = {
-        f'{port}/tcp': (host, int(port))
-    } if export else {}
 
+# deploy node
+def node(index, nowait=False):
+    heap = heapsize()
+
+    if cluster_nodes > 1:
+        name = f'{tenant}-{title}-{index}'
+        node_hostname = f'{hostname}-{index}'
+        data = f'{path}/data.d/{index}'
+        ports = {
+            f'{port}/tcp': (host, int(port) + index - 1)
+        } if export else {}
+        masters = [f'{hostname}-{other}' for other in range(1, cluster_nodes + 1) if not roles(other) or 'master' in roles(other).split(',')]
+        environment = [
+            f'node.name={node_hostname}',
+            f'cluster.name={tenant}-{title}',
+            f'discovery.seed_hosts={",".join(f"{hostname}-{other}" for other in range(1, cluster_nodes + 1) if other != index)}',
+            f'cluster.initial_master_nodes={",".join(masters)}',
+            f'xpack.security.enabled=true',
+            f'xpack.security.http.ssl.enabled=true',
+            f'xpack.security.http.ssl.key=certs/{node_hostname}/{node_hostname}.key',
+            f'xpack.security.http.ssl.certificate=certs/{node_hostname}/{node_hostname}.crt',
+            f'xpack.security.http.ssl.certificate_authorities=certs/ca/ca.crt',
+            f'xpack.security.transport.ssl.enabled=true',
+            f'xpack.security.transport.ssl.key=certs/{node_hostname}/{node_hostname}.key',
+            f'xpack.security.transport.ssl.certificate=certs/{node_hostname}/{node_hostname}.crt',
+            f'xpack.security.transport.ssl.certificate_authorities=certs/ca/ca.crt',
+            f'xpack.security.transport.ssl.verification_mode=certificate'
+        ]
+        if roles(index): environment.append(f'node.roles={roles(index)}')
+        volumes = [f'{path}/conf.d/certs:/usr/share/elasticsearch/config/certs']
+    else:
+        name = f'{tenant}-{title}'
+        node_hostname = hostname
+        data = f'{path}/data.d'
+        ports = {
+            f'{port}/tcp': (host, int(port))
+        } if export else {}
+        environment = [
+            f'discovery.type=single-node'
+        ]
+        volumes = []
+
+    try: os.makedirs(data)
+    except: pass
+
+    since = time.time()
     container = client.containers.run(
         f'{tenant}/{title}:{version}',
         detach=True,
-        name=f'{tenant}-{title}',
-        hostname=hostname,
+        name=name,
+        hostname=node_hostname,
         network=tenant,
         mem_limit=memory,
         links=container_links,
         ports=ports,
-        environment=[
-            f'discovery.type=single-node'
+        environment=environment + [
+            f'bootstrap.memory_lock=true',
+            f'path.repo=/back.d',
+            f'ES_JAVA_OPTS=-Xms{heap}m -Xmx{heap}m'
         ],
-        volumes=[
+        ulimits=[
+            docker.types.Ulimit(name='memlock', soft=-1, hard=-1),
+            docker.types.Ulimit(name='nofile', soft=65535, hard=65535)
+        ],
+        volumes=volumes + [
             f'{path}/conf.d:/conf.d',
-            f'{path}/data.d:/usr/share/elasticsearch/data',
+            f'{path}/conf.d/users:/usr/share/elasticsearch/config/users',
+            f'{path}/conf.d/users_roles:/usr/share/elasticsearch/config/users_roles',
+            f'{data}:/usr/share/elasticsearch/data',
             f'{path}/back.d:/back.d'
         ],
         healthcheck={
-            'test': 'curl -k https://localhost:9200 || exit 1',
+            'test': f"curl -skf -u {shlex.quote(f'{system_access_key}:{system_secret_key}')} 'https://localhost:9200/_cluster/health?wait_for_status=yellow&timeout=1s' || exit 1",
             'interval': health_check_interval * 1000000000,
             'timeout': health_check_timeout * 1000000000,
             'retries': health_check_retries
@@ -95,37 +262,58 @@ def deploy(nowait=False):
         }
     )
 
-    while not nowait:
-        time.sleep(1)
-        container.reload()
-        print('check desire status of container')
-        if container.status != 'running':
-            print('container was exited')
+    if not nowait: wait(container, since)
+    return container
+
+
+# deploy
+def deploy(nowait=False):
+    try: os.mkdir(f'{path}/conf.d')
+    except: pass
+    try: os.mkdir(f'{path}/data.d')
+    except: pass
+    try: os.mkdir(f'{path}/back.d')
+    except: pass
+
+    preflight()
+    realm()
+    if cluster_nodes > 1: certificates()
+
+    with ThreadPoolExecutor(max_workers=cluster_nodes) as executor:
+        futures = [executor.submit(node, index, nowait) for index in range(1, cluster_nodes + 1)]
+    containers = [future.result() for future in futures]
+
+    if not nowait:
+        status = request(containers[0], 'GET', f'/_cluster/health?wait_for_status=yellow&timeout={health_check_interval * health_check_retries}s')
+        if status.get('status') not in ['green', 'yellow']:
+            print(f'cluster {status.get("cluster_name", f"{tenant}-{title}")} is not ready : {status.get("status", status)}')
             exit(1)
-        if 'Health' in container.attrs['State'] and container.attrs['State']['Health']['Status'] == 'healthy':
-            print('container is healthy')
-            container.exec_run(f'/usr/share/elasticsearch/bin/elasticsearch-users useradd {system_access_key} -p {system_secret_key} -r superuser -s')
-            break
+        print(f"cluster {status['cluster_name']} is {status['status']} with {status['number_of_nodes']} nodes")
+        repository(containers[0])
+        templates(containers[0])
 
 
 # start
 def start():
     try:
-        for container in client.containers.list(all=True, filters={'name': title}): container.start()
+        with ThreadPoolExecutor() as executor:
+            for container in client.containers.list(all=True, filters={'name': title}): executor.submit(container.start)
     except: pass
 
 
 # restart
 def restart():
     try:
-        for container in client.containers.list(all=True, filters={'name': title}): container.restart()
+        with ThreadPoolExecutor() as executor:
+            for container in client.containers.list(all=True, filters={'name': title}): executor.submit(container.restart, timeout=stop_timeout)
     except: pass
 
 
 # stop
 def stop():
     try:
-        for container in client.containers.list(all=True, filters={'name': title}): container.stop()
+        with ThreadPoolExecutor() as executor:
+            for container in client.containers.list(all=True, filters={'name': title}): executor.submit(container.stop, timeout=stop_timeout)
     except: pass
 
 
@@ -157,10 +345,207 @@ def monitor():
 # logs
 def logs():
     try:
-        for container in client.containers.list(all=True, filters={'name': title}): print(container.logs(tail=100).decode('utf-8'))
+        for container in client.containers.list(all=True, filters={'name': title}):
+            for chunk in container.logs(stream=True, follow=False, tail=100): print(chunk.decode('utf-8', 'replace'), end='')
+    except: pass
+
+
+#===============================================================================
+# Cluster API
+#===============================================================================
+# request elasticsearch api inside container
+def request(container, method, uri, body=None):
+    command = ['curl', '--silent', '--insecure', '--user', f'{system_access_key}:{system_secret_key}', '--request', method, '--header', 'Content-Type: application/json', f'https://localhost:9200{uri}']
+    if body is not None: command += ['--data-binary', json.dumps(body)]
+    output = container.exec_run(command).output.decode('utf-8')
+    try: return json.loads(output)
+    except ValueError: return {'error': output}
+
+
+# cluster health
+def health():
+    try:
+        container = client.containers.list(filters={'name': f'{tenant}-{title}'})[0]
+        print(json.dumps(request(container, 'GET', '/_cluster/health'), indent=2))
     except: pass
 
 
+#===============================================================================
+# Templates & Ingest
+#===============================================================================
+# apis of template.d kinds in dependency order
+kinds = [
+    ('ilm', '/_ilm/policy'),
+    ('pipeline', '/_ingest/pipeline'),
+    ('component', '/_component_template'),
+    ('index', '/_index_template')
+]
+
+
+# apply templates, ilm policies and ingest pipelines of template.d
+def templates(container=None):
+    container = container if container else api()
+    for kind, uri in kinds:
+        directory = f'{path}/template.d/{kind}'
+        if not os.path.isdir(directory): continue
+        for file in sorted(os.listdir(directory)):
+            if not file.endswith('.json'): continue
+            with open(f'{directory}/{file}', 'r') as fd: body = json.load(fd)
+            result = request(container, 'PUT', f'{uri}/{file[:-5]}', body)
+            if not result.get('acknowledged'):
+                print(f'could not apply {kind} {file[:-5]} : {result}')
+                exit(1)
+            print(f'{kind} {file[:-5]} is applied')
+
+
+# indexed documents of index pattern
+def indexed(container, indices):
+    return request(container, 'GET', f'/{indices}/_stats/indexing')['_all']['primaries']['indexing']['index_total']
+
+
+# bulk ingest mode of index pattern, settings are restored when it is turned off
+def bulk(mode, indices='*', interval=10):
+    container = api()
+    state = f'{path}/conf.d/bulk.json'
+    if mode == 'on':
+        if os.path.isfile(state):
+            print('bulk ingest mode is already on')
+            exit(1)
+        settings = request(container, 'GET', f'/{indices}/_settings?expand_wildcards=open')
+        if 'error' in settings or 'status' in settings:
+            print(f'could not get settings of {indices} : {settings}')
+            exit(1)
+        saved = {}
+        for index, value in settings.items():
+            if index.startswith('.'): continue
+            saved[index] = {key: value['settings']['index'].get(key) for key in ['refresh_interval', 'number_of_replicas', 'auto_expand_replicas']}
+        if not saved:
+            print(f'no indices match {indices}')
+            exit(1)
+        total = indexed(container, indices)
+        time.sleep(interval)
+        before = (indexed(container, indices) - total) / interval
+        for index in saved:
+            result = request(container, 'PUT', f'/{index}/_settings', {'index': {'refresh_interval': '-1', 'number_of_replicas': 0, 'auto_expand_replicas': False}})
+            if not result.get('acknowledged'):
+                # indices already switched are put back
+                for other, value in saved.items():
+                    if other == index: break
+                    request(container, 'PUT', f'/{other}/_settings', {'index': value})
+                print(f'could not apply bulk ingest settings to {index} : {result}')
+                exit(1)
+        with open(state, 'w') as fd: json.dump({'indices': indices, 'settings': saved, 'time': time.time(), 'total': indexed(container, indices), 'before': before}, fd)
+        print(f'bulk ingest mode is on for {len(saved)} indices, ingest rate before was {before:.1f} docs/s')
+    else:
+        if not os.path.isfile(state):
+            print('bulk ingest mode is not on')
+            exit(1)
+        with open(state, 'r') as fd: saved = json.load(fd)
+        during = (indexed(container, saved['indices']) - saved['total']) / (time.time() - saved['time'])
+        for index, value in saved['settings'].items(): request(container, 'PUT', f'/{index}/_settings', {'index': value})
+        request(container, 'POST', f"/{','.join(saved['settings'])}/_refresh")
+        os.remove(state)
+        print(f"bulk ingest mode is off for {len(saved['settings'])} indices, ingest rate was {saved['before']:.1f} docs/s before and {during:.1f} docs/s in bulk mode")
+
+
+#===============================================================================
+# Snapshot & Restore
+#===============================================================================
+# running node for api requests
+def api():
+    containers = client.containers.list(filters={'name': f'{tenant}-{title}'})
+    if not containers:
+        print(f'{tenant}-{title} is not running')
+        exit(1)
+    return containers[0]
+
+
+# register back.d as fs snapshot repository
+def repository(container):
+    result = request(container, 'PUT', f'/_snapshot/{snapshot_repository}', {'type': 'fs', 'settings': {'location': '/back.d', 'compress': True}})
+    if not result.get('acknowledged'):
+        print(f'could not register snapshot repository {snapshot_repository} : {result}')
+        exit(1)
+
+
+# snapshot
+def snapshot(name=None):
+    container = api()
+    repository(container)
+    name = name if name else time.strftime('snapshot-%Y%m%d%H%M%S')
+    result = request(container, 'PUT', f'/_snapshot/{snapshot_repository}/{name}?wait_for_completion=false', {'indices': '*', 'include_global_state': True})
+    if not result.get('accepted'):
+        print(f'could not start snapshot {name} : {result}')
+        exit(1)
+    start = time.time()
+    while True:
+        time.sleep(1)
+        status = request(container, 'GET', f'/_snapshot/{snapshot_repository}/{name}/_status')['snapshots'][0]
+        shards = status['shards_stats']
+        stats = status['stats']
+        print(f"snapshot {name} {status['state']} : {shards['done']}/{shards['total']} shards, {stats.get('processed', stats['incremental'])['size_in_bytes'] / 1048576:.1f}/{stats['incremental']['size_in_bytes'] / 1048576:.1f}MB new of {stats['total']['size_in_bytes'] / 1048576:.1f}MB")
+        if status['state'] not in ['INIT', 'STARTED']: break
+    print(f"snapshot {name} is {status['state'].lower()} in {time.time() - start:.1f}s")
+    if status['state'] != 'SUCCESS': exit(1)
+    prune()
+
+
+# restore
+def restore(name, indices='*'):
+    container = api()
+    repository(container)
+    snapshots = request(container, 'GET', f'/_snapshot/{snapshot_repository}/{name}').get('snapshots')
+    if not snapshots:
+        print(f'snapshot {name} does not exist')
+        exit(1)
+    targets = [index for index in snapshots[0]['indices'] if not index.startswith('.') and fnmatch.fnmatch(index, indices)]
+    if not targets:
+        print(f'snapshot {name} has no indices matching {indices}')
+        exit(1)
+    # open indices can not be restored over
+    request(container, 'POST', f'/{",".join(targets)}/_close?ignore_unavailable=true&expand_wildcards=all')
+    start = time.time()
+    result = request(container, 'POST', f'/_snapshot/{snapshot_repository}/{name}/_restore', {'indices': ','.join(targets), 'include_global_state': False})
+    if not result.get('accepted'):
+        print(f'could not start restore of {name} : {result}')
+        exit(1)
+    while True:
+        time.sleep(1)
+        failed = [shard for shard in request(container, 'GET', f'/_cat/shards/{",".join(targets)}?format=json&h=index,shard,prirep,state,unassigned.reason') if shard.get('unassigned.reason') == 'RESTORE_FAILED']
+        if failed:
+            print(f'restore {name} failed on ' + ', '.join(f"{shard['index']}[{shard['shard']}]" for shard in failed))
+            exit(1)
+        if time.time() - start > snapshot_timeout:
+            print(f'restore {name} is not done in {snapshot_timeout}s')
+            exit(1)
+        # recoveries of earlier restores of the same indices are still listed
+        shards = [shard for index in request(container, 'GET', f'/{",".join(targets)}/_recovery').values() for shard in index['shards'] if shard['type'] == 'SNAPSHOT' and shard['start_time_in_millis'] >= int(start * 1000)]
+        done = sum(1 for shard in shards if shard['stage'] == 'DONE')
+        recovered = sum(shard['index']['size']['recovered_in_bytes'] for shard in shards)
+        total = sum(shard['index']['size']['total_in_bytes'] for shard in shards)
+        print(f'restore {name} : {done}/{len(shards)} shards, {recovered / 1048576:.1f}/{total / 1048576:.1f}MB')
+        if shards and done == len(shards): break
+    print(f'{", ".join(targets)} are restored from {name} in {time.time() - start:.1f}s')
+
+
+# list snapshots
+def snapshots():
+    container = api()
+    repository(container)
+    for item in request(container, 'GET', f'/_snapshot/{snapshot_repository}/_all').get('snapshots', []):
+        print(f"{item['snapshot']:<32}{item['state']:<12}{item.get('start_time', ''):<28}{len(item['indices']):>4} indices")
+
+
+# prune snapshots over retention
+def prune():
+    container = api()
+    repository(container)
+    names = [item['snapshot'] for item in sorted(request(container, 'GET', f'/_snapshot/{snapshot_repository}/_all').get('snapshots', []), key=lambda item: item.get('start_time_in_millis', 0), reverse=True)]
+    if names[snapshot_retention:]:
+        request(container, 'DELETE', f'/_snapshot/{snapshot_repository}/{",".join(names[snapshot_retention:])}')
+        print(f'{", ".join(names[snapshot_retention:])} are pruned')
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('-b', '--build', action='store_true', help='build container')
@@ -172,10 +557,20 @@ if __name__ == '__main__':
     parser.add_argument('-p', '--purge', action='store_true', help='purge container')
     parser.add_argument('-l', '--logs', action='store_true', help='show container logs')
     parser.add_argument('-m', '--monitor', action='store_true', help='show container stats')
+    parser.add_argument('-g', '--health', action='store_true', help='show cluster health')
+    parser.add_argument('--snapshot', nargs='?', const='', metavar='NAME', help='snapshot indices into back.d')
+    parser.add_argument('--restore', metavar='NAME', help='restore indices from snapshot')
+    parser.add_argument('--indices', default='*', help='index pattern to restore or to bulk ingest')
+    parser.add_argument('--snapshots', action='store_true', help='list snapshots of back.d')
+    parser.add_argument('--prune', action='store_true', help='prune snapshots over retention')
+    parser.add_argument('--templates', action='store_true', help='apply template.d to running cluster')
+    parser.add_argument('--bulk', choices=['on', 'off'], help='turn bulk ingest mode of --indices on or off')
+    parser.add_argument('--interval', type=int, default=10, help='seconds to sample ingest rate before bulk mode')
     parser.add_argument('-w', '--nowait', action='store_true', help='wait desire status of container')
+    parser.add_argument('-n', '--nocache', action='store_true', help='build container without cache')
 
     args = parser.parse_args()
-    if not (args.logs or args.monitor):
+    if not (args.logs or args.monitor or args.health or args.snapshot is not None or args.restore or args.snapshots or args.prune or args.templates or args.bulk):
         argCount = 0
         argCount += 1 if args.build else 0
         argCount += 1 if args.deploy else 0
@@ -186,7 +581,7 @@ if __name__ == '__main__':
         argCount += 1 if args.purge else 0
         if argCount > 1 or argCount == 0: parser.print_help()
 
-    if args.build: build()
+    if args.build: build(args.nocache)
     elif args.deploy: deploy(args.nowait)
     elif args.start: start()
     elif args.restart: restart()
@@ -195,3 +590,10 @@ if __name__ == '__main__':
     elif args.purge: purge()
     if args.monitor: monitor()
     if args.logs: logs()
+    if args.health: health()
+    if args.snapshot is not None: snapshot(args.snapshot)
+    elif args.restore: restore(args.restore, args.indices)
+    elif args.prune: prune()
+    if args.snapshots: snapshots()
+    if args.templates: templates()
+    if args.bulk: bulk(args.bulk, args.indices, args.interval)
@@ -12,8 +12,11 @@ import time
 import json
 import shutil
 import docker
+import fnmatch
+import hashlib
 import argparse
 import configparser
+from concurrent.futures import ThreadPoolExecutor
 
 #===============================================================================
 # Implement
@@ -43,6 +46,8 @@ health_check_interval = int(config['default']['health_check_interval'])
 health_check_timeout = int(config['default']['health_check_timeout'])
 health_check_retries = int(config['default']['health_check_retries'])
 
+stop_timeout = int(config['default']['stop_timeout'])
+
 container_links = config._sections['container:links']
 
 server_name = config['service']['server_name']
@@ -51,8 +56,59 @@ server_name = config['service']['server_name']
 #===============================================================================
 # Container Control
 #===============================================================================
+# digest of build context
+def digest():
+    with open(f'{path}/.dockerignore', 'r') as fd: ignores = [line.strip() for line in fd if line.strip() and not line.startswith('#')]
+    hash = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        relative = os.path.relpath(root, path)
+        dirs[:] = sorted(name for name in dirs if not any(fnmatch.fnmatch(os.path.normpath(f'{relative}/{name}'), ignore) for ignore in ignores))
+        for name in sorted(files):
+            file = os.path.normpath(f'{relative}/{name}')
+            if any(fnmatch.fnmatch(file, ignore) for ignore in ignores): continue
+            hash.update(file.encode('utf-8') + b'\0')
+            with open(f'{path}/{file}', 'rb') as fd:
+                for chunk in iter(lambda: fd.read(1048576), b''): hash.update(chunk)
+            hash.update(b'\0')
+    return hash.hexdigest()
+
+
 # build
-def build(): client.images.build(nocache=True, rm=True, path=f'{path}', tag=f'{tenant}/{title}:{version}')
+def build(nocache=False):
+    tag = f'{tenant}/{title}:{version}'
+    context = digest()
+    if not nocache:
+        try:
+            if client.images.get(tag).labels.get('eqpls.context.digest') == context:
+                print(f'{tag} is up to date')
+                return
+        except docker.errors.ImageNotFound: pass
+    client.images.build(nocache=nocache, rm=True, path=f'{path}', tag=tag, labels={'eqpls.context.digest': context})
+
+
+# wait desire status of container
+def wait(container, since):
+    until = int(since) + health_check_interval * health_check_retries + health_check_timeout
+    events = client.events(since=int(since), until=until, decode=True, filters={
+        'container': container.id,
+        'event': ['start', 'health_status', 'die']
+    })
+    started = False
+    try:
+        for event in events:
+            # events of the second of since are replayed, so only the ones after own start count
+            if event['Action'] == 'start': started = event['timeNano'] >= int(since * 1000000000)
+            if not started: continue
+            if event['Action'] == 'die':
+                print(f'{container.name} was exited')
+                exit(1)
+            if event['Action'].split(': ')[-1] == 'healthy':
+                print(f'{container.name} is healthy')
+                return
+    finally: events.close()
+    container.reload()
+    print(f'{container.name} was not healthy in {until - int(since)}s : {container.status}')
+    exit(1)
 
 
 # deploy
@@ -148,6 +204,7 @@ http {
         f'{port}/tcp': (host, int(port))
     } if export else {}
 
+    since = time.time()
     container = client.containers.run(
         f'{tenant}/{title}:{version}',
         detach=True,
@@ -171,36 +228,30 @@ http {
         }
     )
 
-    while not nowait:
-        time.sleep(1)
-        container.reload()
-        print('check desire status of container')
-        if container.status != 'running':
-            print('container was exited')
-            exit(1)
-        if 'Health' in container.attrs['State'] and container.attrs['State']['Health']['Status'] == 'healthy':
-            print('container is healthy')
-            break
+    if not nowait: wait(container, since)
 
 
 # start
 def start():
     try:
-        for container in client.containers.list(all=True, filters={'name': title}): container.start()
+        with ThreadPoolExecutor() as executor:
+            for container in client.containers.list(all=True, filters={'name': title}): executor.submit(container.start)
     except: pass
 
 
 # restart
 def restart():
     try:
-        for container in client.containers.list(all=True, filters={'name': title}): container.restart()
+        with ThreadPoolExecutor() as executor:
+            for container in client.containers.list(all=True, filters={'name': title}): executor.submit(container.restart, timeout=stop_timeout)
     except: pass
 
 
 # stop
 def stop():
     try:
-        for container in client.containers.list(all=True, filters={'name': title}): container.stop()
+        with ThreadPoolExecutor() as executor:
+            for container in client.containers.list(all=True, filters={'name': title}): executor.submit(container.stop, timeout=stop_timeout)
     except: pass
 
 
@@ -230,7 +281,8 @@ def monitor():
 # logs
 def logs():
     try:
-        for container in client.containers.list(all=True, filters={'name': title}): print(container.logs(tail=100).decode('utf-8'))
+        for container in client.containers.list(all=True, filters={'name': title}):
+            for chunk in container.logs(stream=True, follow=False, tail=100): print(chunk.decode('utf-8', 'replace'), end='')
     except: pass
 
 
@@ -246,6 +298,7 @@ if __name__ == '__main__':
     parser.add_argument('-l', '--logs', action='store_true', help='show container logs')
     parser.add_argument('-m', '--monitor', action='store_true', help='show container stats')
     parser.add_argument('-w', '--nowait', action='store_true', help='wait desire status of container')
+    parser.add_argument('-n', '--nocache', action='store_true', help='build container without cache')
 
     args = parser.parse_args()
     if not (args.logs or args.monitor):
@@ -259,7 +312,7 @@ if __name__ == '__main__':
         argCount += 1 if args.purge else 0
         if argCount > 1 or argCount == 0: parser.print_help()
 
-    if args.build: build()
+    if args.build: build(args.nocache)
     elif args.deploy: deploy(args.nowait)
     elif args.start: start()
     elif args.restart: restart()
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+'''
+Equal Plus
+@author: Hye-Churn Jang
+'''
+
+#===============================================================================
+# Import
+#===============================================================================
+import os
+import time
+import json
+import shutil
+import docker
+import fnmatch
+import hashlib
+import argparse
+import configparser
+from concurrent.futures import ThreadPoolExecutor
+
+#===============================================================================
+# Implement
+#===============================================================================
+# load configs
+path = os.path.dirname(os.path.realpath(__file__))
+config = configparser.ConfigParser()
+config.read(f'{path}/module.ini', encoding='utf-8')
+client = docker.from_env()
+
+# default configs
+title = config['default']['title']
+tenant = config['default']['tenant']
+version = config['default']['version']
+
+memory = config['default']['memory']
+
+hostname = config['default']['hostname']
+host = config['default']['host']
+port = config['default']['port']
+export = True if config['default']['export'].lower() == 'true' else False
+
+system_access_key = config['default']['system_access_key']
+system_secret_key = config['default']['system_secret_key']
+
+health_check_interval = int(config['default']['health_check_interval'])
+health_check_timeout = int(config['default']['health_check_timeout'])
+health_check_retries = int(config['default']['health_check_retries'])
+
+stop_timeout = int(config['default']['stop_timeout'])
+
+container_links = config._sections['container:links']
+
+pool_mode = config['pgbouncer']['pool_mode']
+max_client_conn = int(config['pgbouncer']['max_client_conn'])
+default_pool_size = int(config['pgbouncer']['default_pool_size'])
+reserve_pool_size = int(config['pgbouncer']['reserve_pool_size'])
+max_prepared_statements = int(config['pgbouncer']['max_prepared_statements'])
+
+database_hostname = config['driver:postgresql']['hostname']
+database_hostport = config['driver:postgresql']['hostport']
+database_username = config['driver:postgresql']['username']
+database_password = config['driver:postgresql']['password']
+
+databases = config._sections['pgbouncer:databases']
+
+
+#===============================================================================
+# Container Control
+#===============================================================================
+# digest of build context
+def digest():
+    with open(f'{path}/.dockerignore', 'r') as fd: ignores = [line.strip() for line in fd if line.strip() and not line.startswith('#')]
+    hash = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        relative = os.path.relpath(root, path)
+        dirs[:] = sorted(name for name in dirs if not any(fnmatch.fnmatch(os.path.normpath(f'{relative}/{name}'), ignore) for ignore in ignores))
+        for name in sorted(files):
+            file = os.path.normpath(f'{relative}/{name}')
+            if any(fnmatch.fnmatch(file, ignore) for ignore in ignores): continue
+            hash.update(file.encode('utf-8') + b'\0')
+            with open(f'{path}/{file}', 'rb') as fd:
+                for chunk in iter(lambda: fd.read(1048576), b''): hash.update(chunk)
+            hash.update(b'\0')
+    return hash.hexdigest()
+
+
+# build
+def build(nocache=False):
+    tag = f'{tenant}/{title}:{version}'
+    context = digest()
+    if not nocache:
+        try:
+            if client.images.get(tag).labels.get('eqpls.context.digest') == context:
+                print(f'{tag} is up to date')
+                return
+        except docker.errors.ImageNotFound: pass
+    client.images.build(nocache=nocache, rm=True, path=f'{path}', tag=tag, labels={'eqpls.context.digest': context})
+
+
+# wait desire status of container
+def wait(container, since):
+    until = int(since) + health_check_interval * health_check_retries + health_check_timeout
+    events = client.events(since=int(since), until=until, decode=True, filters={
+        'container': container.id,
+        'event': ['start', 'health_status', 'die']
+    })
+    started = False
+    try:
+        for event in events:
+            # events of the second of since are replayed, so only the ones after own start count
+            if event['Action'] == 'start': started = event['timeNano'] >= int(since * 1000000000)
+            if not started: continue
+            if event['Action'] == 'die':
+                print(f'{container.name} was exited')
+                exit(1)
+            if event['Action'].split(': ')[-1] == 'healthy':
+                print(f'{container.name} is healthy')
+                return
+    finally: events.close()
+    container.reload()
+    print(f'{container.name} was not healthy in {until - int(since)}s : {container.status}')
+    exit(1)
+
+
+# deploy
+def deploy(nowait=False):
+    try: os.mkdir(f'{path}/conf.d')
+    except: pass
+
+    ports = {
+        f'{port}/tcp': (host, int(port))
+    } if export else {}
+
+    entries = ''
+    for database, pool in databases.items():
+        pool = pool.split()
+        entries += f'{database} = host={database_hostname} port={database_hostport} dbname={database} pool_size={pool[0]}'
+        entries += f' pool_mode={pool[1]}\n' if len(pool) > 1 else '\n'
+
+    with open(f'{path}/conf.d/pgbouncer.ini', 'w') as fd:
+        fd.write(f"""
+[databases]
+{entries}
+[pgbouncer]
+listen_addr = *
+listen_port = {port}
+auth_type = scram-sha-256
+auth_file = /conf.d/userlist.txt
+admin_users = {system_access_key}
+stats_users = {system_access_key}
+pool_mode = {pool_mode}
+max_client_conn = {max_client_conn}
+default_pool_size = {default_pool_size}
+reserve_pool_size = {reserve_pool_size}
+max_prepared_statements = {max_prepared_statements}
+server_reset_query = DISCARD ALL
+ignore_startup_parameters = extra_float_digits
+        """)
+
+    with open(f'{path}/conf.d/userlist.txt', 'w') as fd:
+        for username, password in {database_username: database_password, system_access_key: system_secret_key}.items():
+            fd.write('"%s" "%s"\n' % (username.replace('"', '""'), password.replace('"', '""')))
+
+    since = time.time()
+    container = client.containers.run(
+        f'{tenant}/{title}:{version}',
+        detach=True,
+        name=f'{tenant}-{title}',
+        hostname=hostname,
+        network=tenant,
+        mem_limit=memory,
+        links=container_links,
+        ports=ports,
+        volumes=[
+            f'{path}/conf.d:/conf.d'
+        ],
+        healthcheck={
+            'test': f'pg_isready --host 127.0.0.1 --port {port} || exit 1',
+            'interval': health_check_interval * 1000000000,
+            'timeout': health_check_timeout * 1000000000,
+            'retries': health_check_retries
+        },
+        restart_policy={
+            'Name': 'on-failure',
+            'MaximumRetryCount': 5
+        }
+    )
+
+    if not nowait: wait(container, since)
+
+
+# start
+def start():
+    try:
+        with ThreadPoolExecutor() as executor:
+            for container in client.containers.list(all=True, filters={'name': title}): executor.submit(container.start)
+    except: pass
+
+
+# restart
+def restart():
+    try:
+        with ThreadPoolExecutor() as executor:
+            for container in client.containers.list(all=True, filters={'name': title}): executor.submit(container.restart, timeout=stop_timeout)
+    except: pass
+
+
+# stop
+def stop():
+    try:
+        with ThreadPoolExecutor() as executor:
+            for container in client.containers.list(all=True, filters={'name': title}): executor.submit(container.stop, timeout=stop_timeout)
+    except: pass
+
+
+# clean
+def clean():
+    for container in client.containers.list(all=True, filters={'name': title}): container.remove(v=True, force=True)
+    shutil.rmtree(f'{path}/conf.d', ignore_errors=True)
+
+
+# purge
+def purge():
+    try:
+        for container in client.containers.list(all=True, filters={'name': title}): container.remove(v=True, force=True)
+    except: pass
+    try: client.images.remove(image=f'{tenant}/{title}:{version}', force=True)
+    except: pass
+    shutil.rmtree(f'{path}/conf.d', ignore_errors=True)
+
+
+# monitor
+def monitor():
+    try:
+        for container in client.containers.list(all=True, filters={'name': title}): print(json.dumps(container.stats(stream=False), indent=2))
+    except: pass
+
+
+# pools
+def pools():
+    try:
+        for container in client.containers.list(filters={'name': title}):
+            for command in ['SHOW POOLS', 'SHOW STATS']:
+                print(container.exec_run(['psql', '--host', '127.0.0.1', '--port', port, '--username', system_access_key, '--command', command, 'pgbouncer'], environment={'PGPASSWORD': system_secret_key}).output.decode('utf-8'))
+    except: pass
+
+
+# logs
+def logs():
+    try:
+        for container in client.containers.list(all=True, filters={'name': title}):
+            for chunk in container.logs(stream=True, follow=False, tail=100): print(chunk.decode('utf-8', 'replace'), end='')
+    except: pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-b', '--build', action='store_true', help='build container')
+    parser.add_argument('-d', '--deploy', action='store_true', help='deploy container')
+    parser.add_argument('-s', '--start', action='store_true', help='start container')
+    parser.add_argument('-r', '--restart', action='store_true', help='restart container')
+    parser.add_argument('-t', '--stop', action='store_true', help='stop container')
+    parser.add_argument('-c', '--clean', action='store_true', help='clean container')
+    parser.add_argument('-p', '--purge', action='store_true', help='purge container')
+    parser.add_argument('-l', '--logs', action='store_true', help='show container logs')
+    parser.add_argument('-m', '--monitor', action='store_true', help='show container stats')
+    parser.add_argument('-o', '--pools', action='store_true', help='show connection pools')
+    parser.add_argument('-w', '--nowait', action='store_true', help='wait desire status of container')
+    parser.add_argument('-n', '--nocache', action='store_true', help='build container without cache')
+
+    args = parser.parse_args()
+    if not (args.logs or args.monitor or args.pools):
+        argCount = 0
+        argCount += 1 if args.build else 0
+        argCount += 1 if args.deploy else 0
+        argCount += 1 if args.start else 0
+        argCount += 1 if args.restart else 0
+        argCount += 1 if args.stop else 0
+        argCount += 1 if args.clean else 0
+        argCount += 1 if args.purge else 0
+        if argCount > 1 or argCount == 0: parser.print_help()
+
+    if args.build: build(args.nocache)
+    elif args.deploy: deploy(args.nowait)
+    elif args.start: start()
+    elif args.restart: restart()
+    elif args.stop: stop()
+    elif args.clean: clean()
+    elif args.purge: purge()
+    if args.monitor: monitor()
+    if args.logs: logs()
+    if args.pools: pools()
@@ -17,11 +17,25 @@ psql -v ON_ERROR_STOP=1 --username postgres <<-EOSQL
 	COMMIT;
 EOSQL
 
+# Create Extensions
+for database in eqpls keycloak; do
+	psql -v ON_ERROR_STOP=1 --username postgres --dbname $database -c 'CREATE EXTENSION IF NOT EXISTS pg_stat_statements;'
+done
+
 # Set Database Scheme & Data
-if [ -f /init.d/eqpls.sql ]; then
-psql -v ON_ERROR_STOP=1 --username postgres --dbname eqpls -f /init.d/eqpls.sql
-fi
+# <database>.sql and <database>.d/<table>.csv (COPY) are loaded in one transaction
+seed() {
+	if [ ! -f /init.d/$1.sql ] && [ ! -d /init.d/$1.d ]; then return; fi
+	{
+		if [ -f /init.d/$1.sql ]; then echo "\\i /init.d/$1.sql"; fi
+		for file in /init.d/$1.d/*.csv; do
+			if [ -f "$file" ]; then echo "COPY $(basename "$file" .csv) FROM '$file' WITH (FORMAT csv, HEADER true);"; fi
+		done
+	} | psql -v ON_ERROR_STOP=1 --username postgres --dbname $1 --single-transaction --file -
+}
+
+seed eqpls
+seed keycloak
 
-if [ -f /init.d/keycloak.sql ]; then
-psql -v ON_ERROR_STOP=1 --username postgres --dbname eqpls -f /init.d/keycloak.sql
-fi
\ No newline at end of file
+# Allow Replication
+echo "host replication repuser all scram-sha-256" >> "$PGDATA/pg_hba.conf"
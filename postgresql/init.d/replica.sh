@@ -0,0 +1,21 @@
+#!/bin/bash
+set -e
+
+# Bootstrap Standby #########################################################
+if [ ! -s "$PGDATA/PG_VERSION" ]; then
+	chown postgres:postgres "$PGDATA"
+	chmod 700 "$PGDATA"
+	su-exec postgres pg_basebackup \
+		--host "$PRIMARY_HOST" \
+		--port "$PRIMARY_PORT" \
+		--username repuser \
+		--pgdata "$PGDATA" \
+		--wal-method stream \
+		--slot "${REPLICA_NAME//-/_}" \
+		--create-slot \
+		--write-recovery-conf \
+		--checkpoint fast
+fi
+
+# Run Hot Standby ###########################################################
+exec su-exec postgres postgres -c config_file=/conf.d/postgresql.conf -c hot_standby=on -c cluster_name="$REPLICA_NAME"
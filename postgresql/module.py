@@ -7,13 +7,19 @@ Equal Plus
 #===============================================================================
 # Import
 #===============================================================================
+import io
 import os
+import csv
 import time
 import json
+import fcntl
 import shutil
 import docker
+import fnmatch
+import hashlib
 import argparse
 import configparser
+from concurrent.futures import ThreadPoolExecutor
 
 #===============================================================================
 # Implement
@@ -30,6 +36,7 @@ tenant = config['default']['tenant']
 version = config['default']['version']
 
 memory = config['default']['memory']
+cpus = float(config['default']['cpus']) if config['default']['cpus'] else None
 
 hostname = config['default']['hostname']
 host = config['default']['host']
@@ -43,14 +50,144 @@ health_check_interval = int(config['default']['health_check_interval'])
 health_check_timeout = int(config['default']['health_check_timeout'])
 health_check_retries = int(config['default']['health_check_retries'])
 
+stop_timeout = int(config['default']['stop_timeout'])
+
 container_links = config._sections['container:links']
 
+profile = config['postgresql']['profile']
+
+replica_count = int(config['replica']['count'])
+replica_port = int(config['replica']['port'])
+replica_timeout = int(config['replica']['timeout'])
+
+backup_databases = [database.strip() for database in config['backup']['databases'].split(',')]
+backup_jobs = int(config['backup']['jobs'])
+backup_compress = config['backup']['compress']
+backup_retention = int(config['backup']['retention'])
+
+snapshot = True if config['snapshot']['enable'].lower() == 'true' else False
+
+# workload profiles of tuning
+profiles = {
+    'oltp': {'max_connections': 300, 'work_mem_ratio': 1, 'maintenance_work_mem_ratio': 16, 'default_statistics_target': 100},
+    'web': {'max_connections': 200, 'work_mem_ratio': 1, 'maintenance_work_mem_ratio': 16, 'default_statistics_target': 100},
+    'mixed': {'max_connections': 100, 'work_mem_ratio': 2, 'maintenance_work_mem_ratio': 16, 'default_statistics_target': 100},
+    'dw': {'max_connections': 40, 'work_mem_ratio': 2, 'maintenance_work_mem_ratio': 8, 'default_statistics_target': 500}
+}
+
+
+#===============================================================================
+# Tuning
+#===============================================================================
+# bytes of docker memory notation
+def bytesize(value):
+    units = {'b': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+    value = value.strip().lower()
+    if value[-2:] in ['kb', 'mb', 'gb']: value = value[:-1]
+    return int(float(value[:-1]) * units[value[-1]]) if value[-1] in units else int(value)
+
+
+# postgresql memory notation of bytes
+def pgsize(value):
+    value = max(value // 1024, 64)
+    for unit, scale in [('GB', 1024 ** 2), ('MB', 1024)]:
+        if value >= scale * 16 or value % scale == 0 and value >= scale: return f'{value // scale}{unit}'
+    return f'{value}kB'
+
+
+# settings of workload profile derived from memory and cpus
+def tune():
+    if profile not in profiles:
+        print(f'unknown tuning profile : {profile} (use {", ".join(profiles)})')
+        exit(1)
+    workload = profiles[profile]
+    total = bytesize(memory)
+    shared_buffers = total // 4
+    gather = max(1, int(cpus) // 2) if cpus else 2
+    settings = {
+        'max_connections': workload['max_connections'],
+        'shared_buffers': pgsize(shared_buffers),
+        'effective_cache_size': pgsize(total * 3 // 4),
+        'maintenance_work_mem': pgsize(min(total // workload['maintenance_work_mem_ratio'], 2 * 1024 ** 3)),
+        # parallel workers of a gather use work_mem each, stock 4MB is kept as floor
+        'work_mem': pgsize(max((total - shared_buffers) // (workload['max_connections'] * 3) // workload['work_mem_ratio'] // (gather if cpus else 1), 4 * 1024 ** 2)),
+        'default_statistics_target': workload['default_statistics_target']
+    }
+    if cpus:
+        settings['max_worker_processes'] = max(8, int(cpus))
+        settings['max_parallel_workers'] = max(1, int(cpus))
+        settings['max_parallel_workers_per_gather'] = gather
+        settings['max_parallel_maintenance_workers'] = min(4, gather)
+    return settings
+
+
+# size of /dev/shm for parallel query from memory
+def shmsize(): return max(bytesize(memory) // 4, 64 * 1024 ** 2)
+
+
+# show tuning
+def tuning():
+    print(f'# tuning profile {profile} for memory {memory}' + (f' and cpus {cpus:g}' if cpus else ''))
+    print(f'# shm_size = {shmsize() // 1024 ** 2}m')
+    for key, value in tune().items(): print(f'{key} = {value}')
+
 
 #===============================================================================
 # Container Control
 #===============================================================================
+# digest of build context
+def digest():
+    with open(f'{path}/.dockerignore', 'r') as fd: ignores = [line.strip() for line in fd if line.strip() and not line.startswith('#')]
+    hash = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        relative = os.path.relpath(root, path)
+        dirs[:] = sorted(name for name in dirs if not any(fnmatch.fnmatch(os.path.normpath(f'{relative}/{name}'), ignore) for ignore in ignores))
+        for name in sorted(files):
+            file = os.path.normpath(f'{relative}/{name}')
+            if any(fnmatch.fnmatch(file, ignore) for ignore in ignores): continue
+            hash.update(file.encode('utf-8') + b'\0')
+            with open(f'{path}/{file}', 'rb') as fd:
+                for chunk in iter(lambda: fd.read(1048576), b''): hash.update(chunk)
+            hash.update(b'\0')
+    return hash.hexdigest()
+
+
 # build
-def build(): client.images.build(nocache=True, rm=True, path=f'{path}', tag=f'{tenant}/{title}:{version}')
+def build(nocache=False):
+    tag = f'{tenant}/{title}:{version}'
+    context = digest()
+    if not nocache:
+        try:
+            if client.images.get(tag).labels.get('eqpls.context.digest') == context:
+                print(f'{tag} is up to date')
+                return
+        except docker.errors.ImageNotFound: pass
+    client.images.build(nocache=nocache, rm=True, path=f'{path}', tag=tag, labels={'eqpls.context.digest': context})
+
+
+# wait desire status of container
+def wait(container, since, timeout=None):
+    until = int(since) + (timeout if timeout else health_check_interval * health_check_retries + health_check_timeout)
+    events = client.events(since=int(since), until=until, decode=True, filters={
+        'container': container.id,
+        'event': ['start', 'health_status', 'die']
+    })
+    started = False
+    try:
+        for event in events:
+            # events of the second of since are replayed, so only the ones after own start count
+            if event['Action'] == 'start': started = event['timeNano'] >= int(since * 1000000000)
+            if not started: continue
+            if event['Action'] == 'die':
+                print(f'{container.name} was exited')
+                exit(1)
+            if event['Action'].split(': ')[-1] == 'healthy':
+                print(f'{container.name} is healthy')
+                return
+    finally: events.close()
+    container.reload()
+    print(f'{container.name} was not healthy in {until - int(since)}s : {container.status}')
+    exit(1)
 
 
 # deploy
@@ -76,8 +213,29 @@ default_text_search_config = 'pg_catalog.english'
 max_wal_size = 1GB
 min_wal_size = 80MB
 wal_level = 'logical'
+shared_preload_libraries = 'pg_stat_statements'
+pg_stat_statements.track = top
+pg_stat_statements.max = 10000
         """)
+        for key, value in tune().items(): fd.write(f'{key} = {value}\n')
+    tuning()
 
+    seeded = None
+    try:
+        if snapshot and not os.listdir(f'{path}/data.d'):
+            seeded = seeding()
+            if os.path.isdir(f'{path}/snap.d/{seeded}'):
+                start = time.time()
+                shutil.rmtree(f'{path}/data.d')
+                shutil.copytree(f'{path}/snap.d/{seeded}', f'{path}/data.d', copy_function=clone)
+                print(f'data.d is restored from snapshot {seeded[:12]} in {time.time() - start:.1f}s')
+                seeded = None
+    except PermissionError as e:
+        # data.d is owned by postgres of container after first start
+        print(f'snapshot is skipped, run as root to read data.d : {e}')
+        seeded = None
+
+    since = time.time()
     container = client.containers.run(
         f'{tenant}/{title}:{version}',
         detach=True,
@@ -85,6 +243,8 @@ wal_level = 'logical'
         hostname=hostname,
         network=tenant,
         mem_limit=memory,
+        shm_size=shmsize(),
+        nano_cpus=int(cpus * 1000000000) if cpus else None,
         links=container_links,
         ports=ports,
         environment=[
@@ -95,9 +255,67 @@ wal_level = 'logical'
         volumes=[
             f'{path}/init.d:/init.d',
             f'{path}/conf.d:/conf.d',
-            f'{path}/data.d:/var/lib/postgresql/data',
+            f'{path}/data.d:/data.d',
             f'{path}/back.d:/back.d'
         ],
+        healthcheck={
+            # temporary server of init.d runs without tcp listener, so seeding is not reported healthy
+            'test': 'pg_isready --host 127.0.0.1 --username postgres || exit 1',
+            'interval': health_check_interval * 1000000000,
+            'timeout': health_check_timeout * 1000000000,
+            'retries': health_check_retries
+        },
+        restart_policy={
+            'Name': 'on-failure',
+            'MaximumRetryCount': 5
+        }
+    )
+
+    if not nowait:
+        wait(container, since)
+        if seeded: capture(container, seeded)
+        if replica_count: replicas()
+    elif replica_count: print(f'replicas are skipped until {tenant}-{title} is healthy, deploy them with -d -R')
+
+
+# deploy replica
+def replica(index, nowait=False):
+    try: os.makedirs(f'{path}/replica.d/{index}')
+    except: pass
+
+    ports = {
+        f'{port}/tcp': (host, replica_port + index - 1)
+    } if export else {}
+
+    # slot of removed replica blocks bootstrapping again
+    if not os.listdir(f'{path}/replica.d/{index}'):
+        client.containers.get(f'{tenant}-{title}').exec_run(['psql', '--username', 'postgres', '--command', f"SELECT pg_drop_replication_slot(slot_name) FROM pg_replication_slots WHERE slot_name = 'replica_{index}' AND NOT active"])
+
+    since = time.time()
+    container = client.containers.run(
+        f'{tenant}/{title}:{version}',
+        detach=True,
+        name=f'{tenant}-{title}-replica-{index}',
+        hostname=f'{hostname}-replica-{index}',
+        network=tenant,
+        mem_limit=memory,
+        shm_size=shmsize(),
+        nano_cpus=int(cpus * 1000000000) if cpus else None,
+        links={**container_links, f'{tenant}-{title}': hostname},
+        ports=ports,
+        entrypoint=['bash', '/init.d/replica.sh'],
+        environment=[
+            f'PRIMARY_HOST={hostname}',
+            f'PRIMARY_PORT={port}',
+            f'PGPASSWORD={system_secret_key}',
+            f'REPLICA_NAME=replica-{index}',
+            f'PGDATA=/data.d',
+        ],
+        volumes=[
+            f'{path}/init.d:/init.d',
+            f'{path}/conf.d:/conf.d',
+            f'{path}/replica.d/{index}:/data.d'
+        ],
         healthcheck={
             'test': 'pg_isready --username postgres || exit 1',
             'interval': health_check_interval * 1000000000,
@@ -110,36 +328,42 @@ wal_level = 'logical'
         }
     )
 
-    while not nowait:
-        time.sleep(1)
-        container.reload()
-        print('check desire status of container')
-        if container.status != 'running':
-            print('container was exited')
-            exit(1)
-        if 'Health' in container.attrs['State'] and container.attrs['State']['Health']['Status'] == 'healthy':
-            print('container is healthy')
-            break
+    if not nowait: wait(container, since, replica_timeout)
+
+
+# deploy replicas
+def replicas(nowait=False):
+    try: status = client.containers.get(f'{tenant}-{title}').attrs['State'].get('Health', {}).get('Status')
+    except docker.errors.NotFound: status = None
+    if status != 'healthy':
+        print(f'{tenant}-{title} is not healthy : {status}')
+        exit(1)
+    with ThreadPoolExecutor() as executor:
+        futures = [executor.submit(replica, index, nowait) for index in range(1, replica_count + 1)]
+    for future in futures: future.result()
 
 
 # start
 def start():
     try:
-        for container in client.containers.list(all=True, filters={'name': title}): container.start()
+        with ThreadPoolExecutor() as executor:
+            for container in client.containers.list(all=True, filters={'name': title}): executor.submit(container.start)
     except: pass
 
 
 # restart
 def restart():
     try:
-        for container in client.containers.list(all=True, filters={'name': title}): container.restart()
+        with ThreadPoolExecutor() as executor:
+            for container in client.containers.list(all=True, filters={'name': title}): executor.submit(container.restart, timeout=stop_timeout)
     except: pass
 
 
 # stop
 def stop():
     try:
-        for container in client.containers.list(all=True, filters={'name': title}): container.stop()
+        with ThreadPoolExecutor() as executor:
+            for container in client.containers.list(all=True, filters={'name': title}): executor.submit(container.stop, timeout=stop_timeout)
     except: pass
 
 
@@ -148,6 +372,7 @@ def clean():
     for container in client.containers.list(all=True, filters={'name': title}): container.remove(v=True, force=True)
     shutil.rmtree(f'{path}/conf.d', ignore_errors=True)
     shutil.rmtree(f'{path}/data.d', ignore_errors=True)
+    shutil.rmtree(f'{path}/replica.d', ignore_errors=True)
 
 
 # purge
@@ -159,6 +384,8 @@ def purge():
     except: pass
     shutil.rmtree(f'{path}/conf.d', ignore_errors=True)
     shutil.rmtree(f'{path}/data.d', ignore_errors=True)
+    shutil.rmtree(f'{path}/replica.d', ignore_errors=True)
+    shutil.rmtree(f'{path}/snap.d', ignore_errors=True)
 
 
 # monitor
@@ -168,11 +395,233 @@ def monitor():
     except: pass
 
 
+# replication lag
+def lag():
+    try:
+        primary = client.containers.get(f'{tenant}-{title}')
+        print(primary.exec_run(['psql', '--username', 'postgres', '--command', 'SELECT application_name, client_addr, state, sync_state, pg_size_pretty(pg_wal_lsn_diff(pg_current_wal_lsn(), replay_lsn)) AS replay_lag_size, write_lag, flush_lag, replay_lag FROM pg_stat_replication ORDER BY application_name']).output.decode('utf-8'))
+        for container in client.containers.list(filters={'name': f'{tenant}-{title}-replica-'}):
+            print(container.name)
+            print(container.exec_run(['psql', '--username', 'postgres', '--command', 'SELECT pg_last_wal_receive_lsn() AS receive_lsn, pg_last_wal_replay_lsn() AS replay_lsn, now() - pg_last_xact_replay_timestamp() AS replay_delay']).output.decode('utf-8'))
+    except: pass
+
+
 # logs
 def logs():
     try:
-        for container in client.containers.list(all=True, filters={'name': title}): print(container.logs(tail=100).decode('utf-8'))
+        for container in client.containers.list(all=True, filters={'name': title}):
+            for chunk in container.logs(stream=True, follow=False, tail=100): print(chunk.decode('utf-8', 'replace'), end='')
+    except: pass
+
+
+#===============================================================================
+# Backup & Restore
+#===============================================================================
+# bytes of directory
+def usage(directory):
+    return sum(os.path.getsize(os.path.join(root, file)) for root, _, files in os.walk(directory) for file in files)
+
+
+# run command in primary container
+def execute(container, command):
+    result = container.exec_run(command)
+    if result.exit_code != 0:
+        print(result.output.decode('utf-8', 'replace'))
+        exit(1)
+    return result.output.decode('utf-8', 'replace')
+
+
+# backup
+def backup(method='logical'):
+    container = client.containers.get(f'{tenant}-{title}')
+    name = f"{time.strftime('%Y%m%d%H%M%S')}-{method}"
+    start = time.time()
+    if method == 'logical':
+        # pg_dump creates only the last level of directory format target
+        execute(container, ['mkdir', '-p', f'/back.d/{name}'])
+        for database in backup_databases:
+            execute(container, ['pg_dump', '--username', 'postgres', '--format', 'directory', '--jobs', str(backup_jobs), '--file', f'/back.d/{name}/{database}', database])
+    elif method == 'physical':
+        execute(container, ['pg_basebackup', '--username', 'postgres', '--pgdata', f'/back.d/{name}', '--format', 'tar', '--wal-method', 'stream', '--compress', backup_compress, '--checkpoint', 'fast'])
+    else:
+        print(f'unknown backup method : {method} (use logical or physical)')
+        exit(1)
+    elapsed = time.time() - start
+    total = usage(f'{path}/back.d/{name}')
+    print(f'{name} : {total / 1048576:.1f}MB in {elapsed:.1f}s ({total / 1048576 / elapsed:.1f}MB/s)')
+    prune()
+
+
+# restore
+def restore(name):
+    directory = f'{path}/back.d/{name}'
+    if not os.path.isdir(directory):
+        print(f'backup {name} does not exist')
+        exit(1)
+    container = client.containers.get(f'{tenant}-{title}')
+    start = time.time()
+    if name.endswith('-physical'):
+        if not os.path.isfile(f'{directory}/base.tar.gz'):
+            print(f'backup {name} is not a gzip compressed base backup')
+            exit(1)
+        container.stop(timeout=stop_timeout)
+        failed = None
+        # data.d is owned by postgres of container, so it is unpacked inside a helper container
+        try:
+            client.containers.run(
+                f'{tenant}/{title}:{version}',
+                remove=True,
+                user='0',
+                environment=[f'BACKUP=/back.d/{name}'],
+                entrypoint=['sh', '-c', ' && '.join([
+                    'find /data.d -mindepth 1 -delete',
+                    'tar -xzf "$BACKUP/base.tar.gz" -C /data.d',
+                    'tar -xzf "$BACKUP/pg_wal.tar.gz" -C /data.d/pg_wal',
+                    'chown -R postgres:postgres /data.d',
+                    'chmod 0700 /data.d'
+                ])],
+                volumes=[
+                    f'{path}/data.d:/data.d',
+                    f'{path}/back.d:/back.d'
+                ]
+            )
+        except docker.errors.ContainerError as e:
+            print(f'backup {name} is not unpacked : {e}')
+            failed = True
+        finally:
+            since = time.time()
+            container.start()
+            wait(container, since)
+        if failed: exit(1)
+    else:
+        for database in sorted(os.listdir(directory)):
+            execute(container, ['pg_restore', '--username', 'postgres', '--clean', '--if-exists', '--jobs', str(backup_jobs), '--dbname', database, f'/back.d/{name}/{database}'])
+    elapsed = time.time() - start
+    total = usage(directory)
+    print(f'{name} is restored : {total / 1048576:.1f}MB in {elapsed:.1f}s ({total / 1048576 / elapsed:.1f}MB/s)')
+
+
+# list backups
+def backups():
+    for name in sorted(name for name in os.listdir(f'{path}/back.d') if name.endswith('-logical') or name.endswith('-physical')):
+        print(f'{name:<32}{usage(f"{path}/back.d/{name}") / 1048576:>12.1f}MB')
+
+
+# prune backups over retention of each method
+def prune():
+    names = sorted((name for name in os.listdir(f'{path}/back.d') if name.endswith('-logical') or name.endswith('-physical')), reverse=True)
+    for method in ['logical', 'physical']:
+        for name in [name for name in names if name.endswith(f'-{method}')][backup_retention:]:
+            shutil.rmtree(f'{path}/back.d/{name}', ignore_errors=True)
+            print(f'{name} is pruned')
+
+
+#===============================================================================
+# Seeded Snapshot
+#===============================================================================
+# digest of everything initializing data.d
+def seeding():
+    hash = hashlib.sha256()
+    hash.update(client.images.get(f'{tenant}/{title}:{version}').id.encode('utf-8'))
+    hash.update(f'{system_access_key}\0{system_secret_key}\0'.encode('utf-8'))
+    for root, dirs, files in os.walk(f'{path}/init.d'):
+        dirs.sort()
+        for name in sorted(files):
+            file = os.path.join(root, name)
+            hash.update(os.path.relpath(file, path).encode('utf-8') + b'\0')
+            with open(file, 'rb') as fd:
+                for chunk in iter(lambda: fd.read(1048576), b''): hash.update(chunk)
+    return hash.hexdigest()
+
+
+# copy file by reflink when filesystem supports it, pages are rewritten in place so no hardlink
+def clone(source, target):
+    try:
+        with open(source, 'rb') as src, open(target, 'wb') as dst: fcntl.ioctl(dst.fileno(), 0x40049409, src.fileno())  # FICLONE
+    except OSError: shutil.copyfile(source, target)
+    shutil.copystat(source, target)
+    return target
+
+
+# capture initialized data.d into snapshot
+def capture(container, seeded):
+    start = time.time()
+    container.stop(timeout=stop_timeout)
+    try:
+        shutil.rmtree(f'{path}/snap.d', ignore_errors=True)
+        os.mkdir(f'{path}/snap.d')
+        shutil.copytree(f'{path}/data.d', f'{path}/snap.d/{seeded}.tmp', copy_function=clone)
+        os.rename(f'{path}/snap.d/{seeded}.tmp', f'{path}/snap.d/{seeded}')
+        print(f'data.d is captured into snapshot {seeded[:12]} in {time.time() - start:.1f}s')
+    except PermissionError as e:
+        shutil.rmtree(f'{path}/snap.d', ignore_errors=True)
+        print(f'snapshot is skipped, run as root to read data.d : {e}')
+    since = time.time()
+    container.start()
+    wait(container, since)
+
+
+#===============================================================================
+# Statements
+#===============================================================================
+# orders of statements report
+orders = {
+    'total': lambda statement: statement['total'],
+    'mean': lambda statement: statement['total'] / statement['calls'] if statement['calls'] else 0,
+    'calls': lambda statement: statement['calls'],
+    'rows': lambda statement: statement['rows']
+}
+
+
+# current statements of pg_stat_statements
+def statements():
+    container = client.containers.get(f'{tenant}-{title}')
+    execute(container, ['psql', '--username', 'postgres', '--dbname', 'eqpls', '--quiet', '--command', 'CREATE EXTENSION IF NOT EXISTS pg_stat_statements'])
+    output = execute(container, ['psql', '--username', 'postgres', '--dbname', 'eqpls', '--csv', '--command', "SELECT d.datname AS database, s.userid, s.queryid, s.calls, s.total_exec_time, s.rows, regexp_replace(s.query, '\\s+', ' ', 'g') AS query FROM pg_stat_statements s JOIN pg_database d ON d.oid = s.dbid"])
+    result = {}
+    for row in csv.DictReader(io.StringIO(output)):
+        result[f"{row['database']}:{row['userid']}:{row['queryid']}"] = {
+            'database': row['database'],
+            'calls': int(row['calls']),
+            'total': float(row['total_exec_time']),
+            'rows': int(row['rows']),
+            'query': row['query']
+        }
+    return result
+
+
+# saved or current statements
+def saved(name):
+    if name == 'now': return statements()
+    with open(f'{path}/back.d/statements/{name}.json', 'r') as fd: return json.load(fd)
+
+
+# save statements snapshot
+def save_queries(name):
+    try: os.makedirs(f'{path}/back.d/statements')
     except: pass
+    with open(f'{path}/back.d/statements/{name}.json', 'w') as fd: json.dump(statements(), fd)
+    print(f'statements snapshot {name} is saved')
+
+
+# reset statements
+def reset_queries():
+    execute(client.containers.get(f'{tenant}-{title}'), ['psql', '--username', 'postgres', '--dbname', 'eqpls', '--command', 'SELECT pg_stat_statements_reset()'])
+    print('statements are reset')
+
+
+# report top statements, between two snapshots when given
+def queries(top=10, order='total', begin=None, end='now'):
+    current = saved(end) if begin else statements()
+    if begin:
+        previous = saved(begin)
+        for key, statement in list(current.items()):
+            if key in previous and previous[key]['calls'] <= statement['calls']:
+                for field in ['calls', 'total', 'rows']: statement[field] -= previous[key][field]
+            if not statement['calls']: current.pop(key)
+    print(f'{"DATABASE":<12}{"CALLS":>10}{"TOTAL(ms)":>14}{"MEAN(ms)":>12}{"ROWS":>12}  QUERY')
+    for statement in sorted(current.values(), key=orders[order], reverse=True)[:top]:
+        print(f"{statement['database']:<12}{statement['calls']:>10}{statement['total']:>14.1f}{orders['mean'](statement):>12.2f}{statement['rows']:>12}  {statement['query'][:100]}")
 
 
 if __name__ == '__main__':
@@ -187,9 +636,24 @@ if __name__ == '__main__':
     parser.add_argument('-l', '--logs', action='store_true', help='show container logs')
     parser.add_argument('-m', '--monitor', action='store_true', help='show container stats')
     parser.add_argument('-w', '--nowait', action='store_true', help='wait desire status of container')
+    parser.add_argument('-n', '--nocache', action='store_true', help='build container without cache')
+    parser.add_argument('-R', '--replica', action='store_true', help='deploy replicas of running primary only')
+    parser.add_argument('-g', '--lag', action='store_true', help='show replication lag')
+    parser.add_argument('--backup', nargs='?', const='logical', choices=['logical', 'physical'], help='backup databases into back.d')
+    parser.add_argument('--restore', metavar='NAME', help='restore backup of back.d')
+    parser.add_argument('--backups', action='store_true', help='list backups of back.d')
+    parser.add_argument('--prune', action='store_true', help='prune backups over retention')
+    parser.add_argument('-q', '--queries', nargs='?', type=int, const=10, metavar='N', help='show top N statements of pg_stat_statements')
+    parser.add_argument('--sort', choices=list(orders.keys()), default='total', help='order of top statements')
+    parser.add_argument('--diff', nargs=2, metavar=('BEGIN', 'END'), help='top statements between two snapshots (END may be now)')
+    parser.add_argument('--save-queries', metavar='NAME', help='save snapshot of pg_stat_statements')
+    parser.add_argument('--reset-queries', action='store_true', help='reset pg_stat_statements')
+    parser.add_argument('-u', '--tuning', action='store_true', help='show tuning of postgresql.conf')
+    parser.add_argument('--profile', choices=list(profiles.keys()), help='tuning profile overriding module.ini')
 
     args = parser.parse_args()
-    if not (args.logs or args.monitor):
+    if args.profile: profile = args.profile
+    if not (args.logs or args.monitor or args.tuning or args.lag or args.backup or args.restore or args.backups or args.prune or args.queries or args.diff or args.save_queries or args.reset_queries):
         argCount = 0
         argCount += 1 if args.build else 0
         argCount += 1 if args.deploy else 0
@@ -200,7 +664,8 @@ if __name__ == '__main__':
         argCount += 1 if args.purge else 0
         if argCount > 1 or argCount == 0: parser.print_help()
 
-    if args.build: build()
+    if args.build: build(args.nocache)
+    elif args.deploy and args.replica: replicas(args.nowait)
     elif args.deploy: deploy(args.nowait)
     elif args.start: start()
     elif args.restart: restart()
@@ -209,3 +674,12 @@ if __name__ == '__main__':
     elif args.purge: purge()
     if args.monitor: monitor()
     if args.logs: logs()
+    if args.tuning: tuning()
+    if args.lag: lag()
+    if args.backup: backup(args.backup)
+    elif args.restore: restore(args.restore)
+    elif args.prune: prune()
+    if args.backups: backups()
+    if args.save_queries: save_queries(args.save_queries)
+    if args.queries or args.diff: queries(args.queries or 10, args.sort, *(args.diff or []))
+    if args.reset_queries: reset_queries()
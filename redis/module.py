@@ -12,8 +12,11 @@ import time
 import json
 import shutil
 import docker
+import fnmatch
+import hashlib
 import argparse
 import configparser
+from concurrent.futures import ThreadPoolExecutor
 
 #===============================================================================
 # Implement
@@ -43,47 +46,180 @@ health_check_interval = int(config['default']['health_check_interval'])
 health_check_timeout = int(config['default']['health_check_timeout'])
 health_check_retries = int(config['default']['health_check_retries'])
 
+stop_timeout = int(config['default']['stop_timeout'])
+
 container_links = config._sections['container:links']
 
+preset = config['redis']['preset']
+
+cluster_primaries = int(config['cluster']['primaries'])
+cluster_replicas = int(config['cluster']['replicas'])
+cluster_nodes = cluster_primaries * (cluster_replicas + 1)
+
+latency_threshold = int(config['instrument']['latency_threshold'])
+slowlog_entries = int(config['instrument']['slowlog_entries'])
+
+backup_retention = int(config['backup']['retention'])
+
+# presets of redis.conf
+presets = {
+    'cache': {'maxmemory_ratio': '0.8', 'maxmemory_policy': 'allkeys-lru', 'save': '', 'appendonly': 'no'},
+    'durable': {'maxmemory_ratio': '0.5', 'maxmemory_policy': 'noeviction', 'save': '3600 1 300 100 60 10000', 'appendonly': 'yes'}
+}
+
+
+#===============================================================================
+# Configuration
+#===============================================================================
+# bytes of docker memory notation
+def bytesize(value):
+    units = {'b': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+    value = value.strip().lower()
+    if value[-2:] in ['kb', 'mb', 'gb']: value = value[:-1]
+    return int(float(value[:-1]) * units[value[-1]]) if value[-1] in units else int(value)
+
+
+# settings of preset overridden by module.ini
+def settings():
+    if preset not in presets:
+        print(f'unknown redis preset : {preset} (use {", ".join(presets)})')
+        exit(1)
+    result = dict(presets[preset])
+    for key in ['maxmemory_ratio', 'maxmemory_policy', 'save', 'appendonly']:
+        if config['redis'][key]: result[key] = config['redis'][key]
+    result['io_threads'] = int(config['redis']['io_threads'])
+    # fork of rdb and aof rewrite copies dirty pages, so persistence keeps more headroom
+    result['maxmemory'] = int(bytesize(memory) * float(result['maxmemory_ratio']))
+    return result
+
+
+# render redis.conf
+def configure(appendonly=None):
+    values = settings()
+    if appendonly: values['appendonly'] = appendonly
+    with open(f'{path}/conf.d/redis.conf', 'w') as fd:
+        fd.write(f"""
+bind * -::*
+protected-mode no
+port {port}
+dir /data
+maxmemory {values['maxmemory']}
+maxmemory-policy {values['maxmemory_policy']}
+save "{values['save']}"
+appendonly {values['appendonly']}
+appendfsync everysec
+io-threads {values['io_threads']}
+io-threads-do-reads {'yes' if values['io_threads'] > 1 else 'no'}
+        """)
+        if cluster_primaries > 1: fd.write(f"""
+cluster-enabled yes
+cluster-config-file nodes.conf
+cluster-node-timeout 5000
+cluster-preferred-endpoint-type hostname
+        """)
+    print(f"# redis preset {preset} for memory {memory}")
+    for key in ['maxmemory', 'maxmemory_policy', 'save', 'appendonly', 'io_threads']: print(f'{key.replace("_", "-")} ' + (f'"{values[key]}"' if key == 'save' else f'{values[key]}'))
+    if cluster_primaries > 1: print(f'cluster-enabled yes ({cluster_primaries} primaries x {cluster_replicas} replicas)')
+
 
 #===============================================================================
 # Container Control
 #===============================================================================
-# build
-def build(): client.images.build(nocache=True, rm=True, path=f'{path}', tag=f'{tenant}/{title}:{version}')
+# digest of build context
+def digest():
+    with open(f'{path}/.dockerignore', 'r') as fd: ignores = [line.strip() for line in fd if line.strip() and not line.startswith('#')]
+    hash = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        relative = os.path.relpath(root, path)
+        dirs[:] = sorted(name for name in dirs if not any(fnmatch.fnmatch(os.path.normpath(f'{relative}/{name}'), ignore) for ignore in ignores))
+        for name in sorted(files):
+            file = os.path.normpath(f'{relative}/{name}')
+            if any(fnmatch.fnmatch(file, ignore) for ignore in ignores): continue
+            hash.update(file.encode('utf-8') + b'\0')
+            with open(f'{path}/{file}', 'rb') as fd:
+                for chunk in iter(lambda: fd.read(1048576), b''): hash.update(chunk)
+            hash.update(b'\0')
+    return hash.hexdigest()
 
 
-# deploy
-def deploy(nowait=False):
-    try: os.mkdir(f'{path}/conf.d')
-    except: pass
-    try: os.mkdir(f'{path}/data.d')
-    except: pass
-    try: os.mkdir(f'{path}/back.d')
+# build
+def build(nocache=False):
+    tag = f'{tenant}/{title}:{version}'
+    context = digest()
+    if not nocache:
+        try:
+            if client.images.get(tag).labels.get('eqpls.context.digest') == context:
+                print(f'{tag} is up to date')
+                return
+        except docker.errors.ImageNotFound: pass
+    client.images.build(nocache=nocache, rm=True, path=f'{path}', tag=tag, labels={'eqpls.context.digest': context})
+
+
+# wait desire status of container
+def wait(container, since):
+    until = int(since) + health_check_interval * health_check_retries + health_check_timeout
+    events = client.events(since=int(since), until=until, decode=True, filters={
+        'container': container.id,
+        'event': ['start', 'health_status', 'die']
+    })
+    started = False
+    try:
+        for event in events:
+            # events of the second of since are replayed, so only the ones after own start count
+            if event['Action'] == 'start': started = event['timeNano'] >= int(since * 1000000000)
+            if not started: continue
+            if event['Action'] == 'die':
+                print(f'{container.name} was exited')
+                exit(1)
+            if event['Action'].split(': ')[-1] == 'healthy':
+                print(f'{container.name} is healthy')
+                return
+    finally: events.close()
+    container.reload()
+    print(f'{container.name} was not healthy in {until - int(since)}s : {container.status}')
+    exit(1)
+
+
+# deploy node
+def node(index, nowait=False):
+    if cluster_primaries > 1:
+        name = f'{tenant}-{title}-{index}'
+        node_hostname = f'{hostname}-{index}'
+        data = f'{path}/data.d/{index}'
+        ports = {
+            f'{port}/tcp': (host, int(port) + index - 1)
+        } if export else {}
+        command = ['redis-server', '/conf.d/redis.conf', '--cluster-announce-hostname', node_hostname]
+    else:
+        name = f'{tenant}-{title}'
+        node_hostname = hostname
+        data = f'{path}/data.d'
+        ports = {
+            f'{port}/tcp': (host, int(port))
+        } if export else {}
+        command = ['redis-server', '/conf.d/redis.conf']
+
+    try: os.makedirs(data)
     except: pass
 
-    ports = {
-        f'{port}/tcp': (host, int(port))
-    } if export else {}
-
+    since = time.time()
     container = client.containers.run(
         f'{tenant}/{title}:{version}',
         detach=True,
-        name=f'{tenant}-{title}',
-        hostname=hostname,
+        name=name,
+        hostname=node_hostname,
         network=tenant,
         mem_limit=memory,
         links=container_links,
         ports=ports,
-        environment=[
-        ],
+        command=command,
         volumes=[
             f'{path}/conf.d:/conf.d',
-            f'{path}/data.d:/data',
+            f'{data}:/data',
             f'{path}/back.d:/back.d',
         ],
         healthcheck={
-            'test': 'redis-cli --raw incr ping || exit 1',
+            'test': "redis-cli ping | grep -q PONG && redis-cli info persistence | grep -q '^loading:0' && ! redis-cli info persistence | grep -q '_status:err' || exit 1",
             'interval': health_check_interval * 1000000000,
             'timeout': health_check_timeout * 1000000000,
             'retries': health_check_retries
@@ -94,36 +230,59 @@ def deploy(nowait=False):
         }
     )
 
-    while not nowait:
-        time.sleep(1)
-        container.reload()
-        print('check desire status of container')
-        if container.status != 'running':
-            print('container was exited')
-            exit(1)
-        if 'Health' in container.attrs['State'] and container.attrs['State']['Health']['Status'] == 'healthy':
-            print('container is healthy')
-            break
+    if not nowait: wait(container, since)
+    return container
+
+
+# deploy
+def deploy(nowait=False, name=None):
+    try: os.mkdir(f'{path}/conf.d')
+    except: pass
+    try: os.mkdir(f'{path}/data.d')
+    except: pass
+    try: os.mkdir(f'{path}/back.d')
+    except: pass
+
+    if cluster_primaries == 2:
+        print('redis cluster needs at least 3 primaries')
+        exit(1)
+    if cluster_replicas > 0 and cluster_primaries < 3:
+        print('redis replicas need cluster mode of at least 3 primaries')
+        exit(1)
+
+    rewrite = bool(name) and settings()['appendonly'] == 'yes'
+    configure('no' if rewrite else None)
+    if name: preload(name)
+
+    with ThreadPoolExecutor(max_workers=cluster_nodes) as executor:
+        futures = [executor.submit(node, index, nowait and not rewrite) for index in range(1, cluster_nodes + 1)]
+    containers = [future.result() for future in futures]
+
+    if rewrite: reappend(containers)
+    if cluster_primaries > 1 and not nowait: create(containers)
 
 
 # start
 def start():
     try:
-        for container in client.containers.list(all=True, filters={'name': title}): container.start()
+        with ThreadPoolExecutor() as executor:
+            for container in client.containers.list(all=True, filters={'name': title}): executor.submit(container.start)
     except: pass
 
 
 # restart
 def restart():
     try:
-        for container in client.containers.list(all=True, filters={'name': title}): container.restart()
+        with ThreadPoolExecutor() as executor:
+            for container in client.containers.list(all=True, filters={'name': title}): executor.submit(container.restart, timeout=stop_timeout)
     except: pass
 
 
 # stop
 def stop():
     try:
-        for container in client.containers.list(all=True, filters={'name': title}): container.stop()
+        with ThreadPoolExecutor() as executor:
+            for container in client.containers.list(all=True, filters={'name': title}): executor.submit(container.stop, timeout=stop_timeout)
     except: pass
 
 
@@ -155,10 +314,238 @@ def monitor():
 # logs
 def logs():
     try:
-        for container in client.containers.list(all=True, filters={'name': title}): print(container.logs(tail=100).decode('utf-8'))
+        for container in client.containers.list(all=True, filters={'name': title}):
+            for chunk in container.logs(stream=True, follow=False, tail=100): print(chunk.decode('utf-8', 'replace'), end='')
     except: pass
 
 
+#===============================================================================
+# Cluster Control
+#===============================================================================
+# cluster nodes
+def nodes(): return sorted(client.containers.list(filters={'name': f'{tenant}-{title}-'}), key=lambda container: int(container.name.rsplit('-', 1)[-1]))
+
+
+# create cluster over healthy nodes
+def create(containers=None):
+    if cluster_primaries < 3:
+        print('redis cluster mode is disabled : set [cluster] primaries over 2')
+        exit(1)
+    containers = containers or nodes()
+    info = containers[0].exec_run(['redis-cli', 'cluster', 'info']).output.decode('utf-8')
+    if 'cluster_state:ok' in info:
+        print(f'cluster {tenant}-{title} is already created')
+        return
+    addresses = []
+    for container in containers:
+        container.reload()
+        addresses.append(f"{container.attrs['NetworkSettings']['Networks'][tenant]['IPAddress']}:{port}")
+    result = containers[0].exec_run(['redis-cli', '--cluster', 'create', *addresses, '--cluster-replicas', str(cluster_replicas), '--cluster-yes'])
+    if result.exit_code != 0:
+        print(result.output.decode('utf-8'))
+        exit(1)
+    print(f'cluster {tenant}-{title} is created with {cluster_primaries} primaries and {cluster_replicas} replicas per primary')
+
+
+# slot map
+def slots():
+    try: container = nodes()[0]
+    except IndexError:
+        print(f'{tenant}-{title} cluster nodes are not running')
+        exit(1)
+    output = container.exec_run(['redis-cli', '--json', 'cluster', 'slots']).output.decode('utf-8')
+    try: ranges = json.loads(output)
+    except ValueError:
+        print(output)
+        exit(1)
+
+    def endpoint(entry):
+        metadata = entry[3] if len(entry) > 3 else {}
+        if isinstance(metadata, list): metadata = dict(zip(metadata[0::2], metadata[1::2]))
+        return f"{metadata.get('hostname') or entry[0]}:{entry[1]}"
+
+    print(f'{"SLOTS":<12} {"PRIMARY":<24} REPLICAS')
+    for entry in sorted(ranges, key=lambda entry: entry[0]):
+        print(f'{f"{entry[0]}-{entry[1]}":<12} {endpoint(entry[2]):<24} {", ".join(endpoint(replica) for replica in entry[3:])}')
+
+
+#===============================================================================
+# Instrumentation
+#===============================================================================
+# redis-cli inside container
+def execute(container, *args, raw=False):
+    output = container.exec_run(['redis-cli', *([] if raw else ['--json']), *args]).output.decode('utf-8')
+    if raw: return output
+    try: return json.loads(output)
+    except ValueError: return []
+
+
+# info fields
+def info(container, section='default'):
+    result = {}
+    for line in execute(container, 'info', section, raw=True).splitlines():
+        if ':' in line and not line.startswith('#'):
+            key, value = line.strip().split(':', 1)
+            result[key] = value
+    return result
+
+
+# sample latency, slowlog and stats of nodes over interval
+def instrument(interval=10):
+    containers = sorted(client.containers.list(filters={'name': f'{tenant}-{title}'}), key=lambda container: container.name)
+    if not containers:
+        print(f'{tenant}-{title} is not running')
+        exit(1)
+    for container in containers: execute(container, 'config', 'set', 'latency-monitor-threshold', str(latency_threshold), raw=True)
+    with ThreadPoolExecutor() as executor: before = list(executor.map(info, containers))
+    time.sleep(interval)
+    with ThreadPoolExecutor() as executor: after = list(executor.map(info, containers))
+
+    for container, start, end in zip(containers, before, after):
+        delta = lambda key: int(end.get(key, 0)) - int(start.get(key, 0))
+        hits, misses = delta('keyspace_hits'), delta('keyspace_misses')
+        print(f'# {container.name} over {interval}s')
+        print(f"ops/sec {delta('total_commands_processed') / interval:.1f}")
+        print(f"hit ratio {f'{hits * 100 / (hits + misses):.2f}%' if hits + misses else '-'} ({hits} hits, {misses} misses)")
+        print(f"evictions {delta('evicted_keys')} (expired {delta('expired_keys')})")
+        print(f"fragmentation {end.get('mem_fragmentation_ratio', '-')} (used {end.get('used_memory_human', '-')}, rss {end.get('used_memory_rss_human', '-')})")
+        print(f'latency latest (threshold {latency_threshold}ms)')
+        for event in execute(container, 'latency', 'latest'):
+            print(f'  {event[0]:<24} {time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(event[1]))} latest {event[2]}ms max {event[3]}ms')
+        print(f'slowlog (last {slowlog_entries})')
+        for entry in execute(container, 'slowlog', 'get', str(slowlog_entries)):
+            print(f'  {entry[0]:<6} {time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(entry[1]))} {entry[2]:>8}us {" ".join(str(arg) for arg in entry[3])[:80]}')
+
+
+#===============================================================================
+# Backup & Restore
+#===============================================================================
+# bytes of directory
+def usage(directory):
+    return sum(os.path.getsize(os.path.join(root, file)) for root, _, files in os.walk(directory) for file in files)
+
+
+# data directory of node relative to data.d
+def relative(index): return f'{index}' if cluster_primaries > 1 else '.'
+
+
+# indexed nodes of deployment
+def members():
+    if cluster_primaries > 1: return [(int(container.name.rsplit('-', 1)[-1]), container) for container in nodes()]
+    return [(1, client.containers.get(f'{tenant}-{title}'))]
+
+
+# names of backups
+def names(): return sorted(name for name in os.listdir(f'{path}/back.d') if name.isdigit() and os.path.isdir(f'{path}/back.d/{name}'))
+
+
+# bgsave and wait for rdb of node
+def bgsave(container):
+    lastsave = execute(container, 'lastsave', raw=True).strip()
+    output = execute(container, 'bgsave', raw=True)
+    if output.startswith('ERR') and 'already in progress' not in output:
+        print(f'{container.name} : {output.strip()}')
+        exit(1)
+    while True:
+        time.sleep(1)
+        status = info(container, 'persistence')
+        if status.get('rdb_bgsave_in_progress') != '0': continue
+        if status.get('rdb_last_bgsave_status') != 'ok':
+            print(f'{container.name} bgsave failed : {status.get("rdb_last_bgsave_status")}')
+            exit(1)
+        if status.get('rdb_last_save_time') != lastsave: return
+
+
+# backup
+def backup():
+    name = time.strftime('%Y%m%d%H%M%S')
+    start = time.time()
+    targets = members()
+    with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+        for future in [executor.submit(bgsave, container) for _, container in targets]: future.result()
+    for index, _ in targets:
+        source = os.path.normpath(f'{path}/data.d/{relative(index)}')
+        target = os.path.normpath(f'{path}/back.d/{name}/{relative(index)}')
+        os.makedirs(target, exist_ok=True)
+        shutil.copy2(f'{source}/dump.rdb', f'{target}/dump.rdb')
+        # cluster nodes keep their slots and identity only with nodes.conf
+        if cluster_primaries > 1: shutil.copy2(f'{source}/nodes.conf', f'{target}/nodes.conf')
+    elapsed = time.time() - start
+    total = usage(f'{path}/back.d/{name}')
+    print(f'{name} : {total / 1048576:.1f}MB in {elapsed:.1f}s')
+    prune()
+
+
+# copy backup into data.d before nodes start
+def preload(name):
+    if name == 'latest': name = (names() or [name])[-1]
+    directory = f'{path}/back.d/{name}'
+    if not os.path.isdir(directory):
+        print(f'backup {name} does not exist')
+        exit(1)
+    for index in range(1, cluster_nodes + 1):
+        if not os.path.isfile(os.path.normpath(f'{directory}/{relative(index)}/dump.rdb')):
+            print(f'backup {name} does not match {cluster_nodes} nodes : {relative(index)}/dump.rdb is missing')
+            exit(1)
+    for index in range(1, cluster_nodes + 1):
+        source = os.path.normpath(f'{directory}/{relative(index)}')
+        target = os.path.normpath(f'{path}/data.d/{relative(index)}')
+        os.makedirs(target, exist_ok=True)
+        # stale aof must not be rewritten over restored rdb
+        shutil.rmtree(f'{target}/appendonlydir', ignore_errors=True)
+        for file in os.listdir(source):
+            if os.path.isfile(f'{source}/{file}'): shutil.copy2(f'{source}/{file}', f'{target}/{file}')
+    print(f'data.d is preloaded from {name}')
+
+
+# turn aof on over rdb loaded nodes, redis loads only aof on startup with appendonly yes
+def reappend(containers):
+    for container in containers:
+        output = execute(container, 'config', 'set', 'appendonly', 'yes', raw=True)
+        if output.strip() != 'OK':
+            print(f'{container.name} : {output.strip()}')
+            exit(1)
+    for container in containers:
+        while True:
+            status = info(container, 'persistence')
+            if status.get('aof_rewrite_in_progress') == '0' and status.get('aof_rewrite_scheduled') == '0': break
+            time.sleep(1)
+        if status.get('aof_enabled') != '1' or status.get('aof_last_bgrewrite_status') != 'ok':
+            print(f'{container.name} aof rewrite failed : {status.get("aof_last_bgrewrite_status")}')
+            exit(1)
+    configure()
+
+
+# restore backup into deployed nodes
+def restore(name):
+    start = time.time()
+    targets = members()
+    rewrite = settings()['appendonly'] == 'yes'
+    with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+        for _, container in targets: executor.submit(container.stop, timeout=stop_timeout)
+    if rewrite: configure('no')
+    preload(name)
+    since = time.time()
+    with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+        for _, container in targets: executor.submit(container.start)
+    with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+        for future in [executor.submit(wait, container, since) for _, container in targets]: future.result()
+    if rewrite: reappend([container for _, container in targets])
+    print(f'{name} is restored in {time.time() - start:.1f}s')
+
+
+# list backups
+def backups():
+    for name in names(): print(f'{name:<32}{usage(f"{path}/back.d/{name}") / 1048576:>12.1f}MB')
+
+
+# prune backups over retention
+def prune():
+    for name in sorted(names(), reverse=True)[backup_retention:]:
+        shutil.rmtree(f'{path}/back.d/{name}', ignore_errors=True)
+        print(f'{name} is pruned')
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('-b', '--build', action='store_true', help='build container')
@@ -171,9 +558,20 @@ if __name__ == '__main__':
     parser.add_argument('-l', '--logs', action='store_true', help='show container logs')
     parser.add_argument('-m', '--monitor', action='store_true', help='show container stats')
     parser.add_argument('-w', '--nowait', action='store_true', help='wait desire status of container')
+    parser.add_argument('-n', '--nocache', action='store_true', help='build container without cache')
+    parser.add_argument('-g', '--slots', action='store_true', help='show cluster slot map')
+    parser.add_argument('-i', '--instrument', action='store_true', help='show latency, slowlog and stats sampled over interval')
+    parser.add_argument('--interval', type=int, default=10, help='sampling interval seconds of instrument')
+    parser.add_argument('--create', action='store_true', help='create cluster over deployed nodes')
+    parser.add_argument('--backup', action='store_true', help='backup rdb of nodes into back.d')
+    parser.add_argument('--restore', metavar='NAME', help='restore backup of back.d (latest for newest), preloaded before nodes start with -d')
+    parser.add_argument('--backups', action='store_true', help='list backups of back.d')
+    parser.add_argument('--prune', action='store_true', help='prune backups over retention')
+    parser.add_argument('--preset', choices=list(presets.keys()), help='redis.conf preset overriding module.ini')
 
     args = parser.parse_args()
-    if not (args.logs or args.monitor):
+    if args.preset: preset = args.preset
+    if not (args.logs or args.monitor or args.slots or args.create or args.instrument or args.backup or args.restore or args.backups or args.prune):
         argCount = 0
         argCount += 1 if args.build else 0
         argCount += 1 if args.deploy else 0
@@ -184,8 +582,8 @@ if __name__ == '__main__':
         argCount += 1 if args.purge else 0
         if argCount > 1 or argCount == 0: parser.print_help()
 
-    if args.build: build()
-    elif args.deploy: deploy(args.nowait)
+    if args.build: build(args.nocache)
+    elif args.deploy: deploy(args.nowait, args.restore)
     elif args.start: start()
     elif args.restart: restart()
     elif args.stop: stop()
@@ -193,3 +591,10 @@ if __name__ == '__main__':
     elif args.purge: purge()
     if args.monitor: monitor()
     if args.logs: logs()
+    if args.create: create()
+    if args.slots: slots()
+    if args.instrument: instrument(args.interval)
+    if args.backup: backup()
+    elif args.restore and not args.deploy: restore(args.restore)
+    elif args.prune: prune()
+    if args.backups: backups()
@@ -0,0 +1,587 @@
+# -*- coding: utf-8 -*-
+'''
+Equal Plus
+@author: Hye-Churn Jang
+'''
+
+#===============================================================================
+# Import
+#===============================================================================
+import os
+import re
+import time
+import json
+import gzip
+import heapq
+import tarfile
+import docker
+import argparse
+import threading
+import configparser
+import importlib.util
+from queue import Queue, Empty
+from datetime import datetime
+from docker.utils import parse_repository_tag
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+
+#===============================================================================
+# Implement
+#===============================================================================
+# load configs
+path = os.path.dirname(os.path.realpath(__file__))
+configs = {}
+for name in sorted(os.listdir(path)):
+    if os.path.isfile(f'{path}/{name}/module.ini') and os.path.isfile(f'{path}/{name}/module.py'):
+        config = configparser.ConfigParser()
+        config.read(f'{path}/{name}/module.ini', encoding='utf-8')
+        configs[name] = config
+client = docker.from_env()
+
+
+#===============================================================================
+# Stack Graph
+#===============================================================================
+# load module
+def load(name):
+    spec = importlib.util.spec_from_file_location(f'eqpls_{name}', f'{path}/{name}/module.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# dependencies of each module from [container:links]
+def graph(names):
+    containers = {f"{config['default']['tenant']}-{config['default']['title']}": name for name, config in configs.items()}
+    depends = {}
+    for name in names:
+        links = configs[name]['container:links'] if 'container:links' in configs[name] else {}
+        depends[name] = set(containers[link] for link in links if link in containers and containers[link] in names and containers[link] != name)
+    return depends
+
+
+# topological waves of independent modules, dependents first when reversed
+def waves(names, reverse=False):
+    depends = graph(names)
+    if reverse: depends = {name: set(other for other, deps in depends.items() if name in deps) for name in depends}
+    result = []
+    while depends:
+        wave = sorted(name for name, deps in depends.items() if not deps)
+        if not wave:
+            print(f'circular container links : {", ".join(sorted(depends))}')
+            exit(1)
+        for name in wave: depends.pop(name)
+        for deps in depends.values(): deps.difference_update(wave)
+        result.append(wave)
+    return result
+
+
+# run function on every module of wave at the same time
+def parallel(wave, func):
+    with ThreadPoolExecutor(max_workers=len(wave)) as executor:
+        futures = {name: executor.submit(func, name) for name in wave}
+    failed = []
+    for name, future in futures.items():
+        try: future.result()
+        except BaseException as e:
+            print(f'{name} was failed : {e}')
+            failed.append(name)
+    return failed
+
+
+#===============================================================================
+# Stack Control
+#===============================================================================
+# deploy
+def deploy(names):
+    for wave in waves(names):
+        print(f'deploy wave : {", ".join(wave)}')
+        start = time.time()
+        failed = parallel(wave, lambda name: load(name).deploy())
+        if failed:
+            print(f'stop deploying stack by failure of {", ".join(failed)}')
+            exit(1)
+        print(f'wave is healthy in {time.time() - start:.1f}s')
+
+
+# base image of module
+def base(name):
+    with open(f'{path}/{name}/Dockerfile', 'r') as fd:
+        for line in fd:
+            words = line.split()
+            if words and words[0].upper() == 'FROM': return [word for word in words[1:] if not word.startswith('--')][0]
+
+
+# pull image with progress report
+def pull(image):
+    if client.images.list(name=image):
+        print(f'{image} is present')
+        return
+    repository, tag = parse_repository_tag(image)
+    layers = {}
+    reported = 0
+    for event in client.api.pull(repository, tag=tag or 'latest', stream=True, decode=True):
+        if 'error' in event: raise Exception(event['error'])
+        if 'id' not in event: continue
+        layer = layers.setdefault(event['id'], {'current': 0, 'total': 0, 'done': False})
+        detail = event.get('progressDetail') or {}
+        if event['status'] == 'Downloading':
+            layer['current'] = detail.get('current', layer['current'])
+            layer['total'] = detail.get('total', layer['total'])
+        elif event['status'] in ['Pull complete', 'Already exists']: layer['done'] = True
+        if time.monotonic() - reported >= 2:
+            reported = time.monotonic()
+            print(f"pulling {image} : {sum(1 for layer in layers.values() if layer['done'])}/{len(layers)} layers, {size(sum(layer['current'] for layer in layers.values()))} / {size(sum(layer['total'] for layer in layers.values()))}")
+    print(f'{image} is pulled')
+
+
+# build
+def build(names, nocache=False, jobs=3):
+    images = {name: base(name) for name in names}
+    timings = {name: {'pull': 0.0, 'build': 0.0, 'status': 'skipped'} for name in names}
+
+    def prepare(image):
+        start = time.time()
+        pull(image)
+        for name in names:
+            if images[name] == image: timings[name]['pull'] = time.time() - start
+
+    failed = parallel(sorted(set(images.values())), prepare)
+    for name in names:
+        if images[name] in failed: timings[name]['status'] = 'pull failed'
+
+    def make(name):
+        module = load(name)
+        tag = f'{module.tenant}/{module.title}:{module.version}'
+        before = [image.id for image in client.images.list(name=tag)]
+        start = time.time()
+        try:
+            module.build(nocache)
+            timings[name]['status'] = 'up to date' if [image.id for image in client.images.list(name=tag)] == before else 'built'
+        except:
+            timings[name]['status'] = 'build failed'
+            raise
+        finally: timings[name]['build'] = time.time() - start
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for name in names:
+            if timings[name]['status'] == 'skipped': executor.submit(make, name)
+
+    print(f'{"MODULE":<16}{"BASE IMAGE":<32}{"PULL":>8}{"BUILD":>8}  STATUS')
+    for name in names: print(f"{name:<16}{images[name]:<32}{timings[name]['pull']:>7.1f}s{timings[name]['build']:>7.1f}s  {timings[name]['status']}")
+    if [name for name in names if 'failed' in timings[name]['status']]: exit(1)
+
+
+# save stack images into one compressed bundle with manifest first
+def bundle(names, file, level=6):
+    tags = [f"{configs[name]['default']['tenant']}/{configs[name]['default']['title']}:{configs[name]['default']['version']}" for name in names]
+    manifest = json.dumps({'images': [{'tag': tag, 'id': client.images.get(tag).id} for tag in tags]}, indent=2).encode('utf-8')
+    start = time.time()
+    # shared layers of images are saved once by requesting every image at the same time
+    response = client.api._get(client.api._url('/images/get'), params={'names': tags}, stream=True)
+    client.api._raise_for_status(response)
+    with open(file, 'wb') as fd:
+        info = tarfile.TarInfo('manifest.json')
+        info.size = len(manifest)
+        info.mtime = int(time.time())
+        fd.write(info.tobuf(tarfile.GNU_FORMAT) + manifest + b'\0' * (-len(manifest) % tarfile.BLOCKSIZE))
+        offset = fd.tell()
+        fd.write(b'\0' * tarfile.BLOCKSIZE)
+        with gzip.GzipFile(filename='images.tar', mode='wb', compresslevel=level, fileobj=fd) as stream:
+            for chunk in response.iter_content(1048576): stream.write(chunk)
+        length = fd.tell() - offset - tarfile.BLOCKSIZE
+        fd.write(b'\0' * (-length % tarfile.BLOCKSIZE + tarfile.BLOCKSIZE * 2))
+        info = tarfile.TarInfo('images.tar.gz')
+        info.size = length
+        info.mtime = int(time.time())
+        fd.seek(offset)
+        fd.write(info.tobuf(tarfile.GNU_FORMAT))
+    elapsed = time.time() - start
+    print(f'{", ".join(tags)} are saved into {file} ({size(os.path.getsize(file))} in {elapsed:.1f}s)')
+
+
+# load stack images from bundle as stream
+def unbundle(file):
+    with tarfile.open(file, mode='r|') as archive:
+        manifest = json.load(archive.extractfile(archive.next()))
+        missing = []
+        for image in manifest['images']:
+            try:
+                if client.images.get(image['tag']).id == image['id']:
+                    print(f"{image['tag']} is present")
+                    continue
+            except docker.errors.ImageNotFound: pass
+            missing.append(image)
+        if not missing: return
+        start = time.time()
+        stream = gzip.GzipFile(fileobj=archive.extractfile(archive.next()), mode='rb')
+        for event in client.api.load_image(iter(lambda: stream.read(1048576), b'')):
+            if 'error' in event: raise Exception(event['error'])
+            if 'stream' in event: print(event['stream'].strip())
+    failed = []
+    for image in missing:
+        try: loaded = client.images.get(image['tag']).id
+        except docker.errors.ImageNotFound: loaded = None
+        if loaded != image['id']: failed.append(image['tag'])
+    if failed:
+        print(f'digest of {", ".join(failed)} does not match manifest')
+        exit(1)
+    print(f'{", ".join(image["tag"] for image in missing)} are loaded in {time.time() - start:.1f}s')
+
+
+# start containers of module and wait for the ones which were not running
+def up(name):
+    module = load(name)
+    since = time.time()
+    stopped = [container for container in module.client.containers.list(all=True, filters={'name': module.title}) if container.status != 'running']
+    module.start()
+    for container in stopped: module.wait(container, since)
+
+
+# start
+def start(names):
+    for wave in waves(names):
+        print(f'start wave : {", ".join(wave)}')
+        failed = parallel(wave, up)
+        if failed:
+            print(f'stop starting stack by failure of {", ".join(failed)}')
+            exit(1)
+
+
+# stop
+def stop(names):
+    for wave in waves(names, reverse=True):
+        print(f'stop wave : {", ".join(wave)}')
+        parallel(wave, lambda name: load(name).stop())
+
+
+# restart
+def restart(names):
+    stop(names)
+    start(names)
+
+
+# show graph
+def show(names):
+    depends = graph(names)
+    for index, wave in enumerate(waves(names)):
+        print(f'wave {index + 1}')
+        for name in wave: print(f'  {name} <- {", ".join(sorted(depends[name])) if depends[name] else "none"}')
+
+
+#===============================================================================
+# Stack Monitor
+#===============================================================================
+# human readable size
+def size(value):
+    for unit in ['B', 'K', 'M', 'G', 'T']:
+        if abs(value) < 1024 or unit == 'T': break
+        value /= 1024
+    return f'{value:.1f}{unit}'
+
+
+# containers of modules
+def containers(names, all=False):
+    result = []
+    for name in names:
+        prefix = f"{configs[name]['default']['tenant']}-{configs[name]['default']['title']}"
+        for container in client.containers.list(all=all, filters={'name': prefix}): result.append((name, container))
+    return result
+
+
+# stats stream of container into bounded ring buffer of samples
+class Collector(threading.Thread):
+
+    def __init__(self, name, container, samples):
+        threading.Thread.__init__(self, daemon=True)
+        self.name = container.name
+        self.module = name
+        self.container = container
+        self.samples = deque(maxlen=samples)
+
+    def run(self):
+        previous = None
+        try:
+            for stats in self.container.stats(stream=True, decode=True):
+                current = self.counters(stats)
+                if previous and current['time'] > previous['time']: self.samples.append(self.sample(stats, previous, current))
+                previous = current
+        except: pass
+
+    def counters(self, stats):
+        networks = stats.get('networks') or {}
+        blkio = (stats.get('blkio_stats') or {}).get('io_service_bytes_recursive') or []
+        return {
+            'time': time.monotonic(),
+            'rx': sum(network['rx_bytes'] for network in networks.values()),
+            'tx': sum(network['tx_bytes'] for network in networks.values()),
+            'read': sum(entry['value'] for entry in blkio if entry['op'].lower() == 'read'),
+            'write': sum(entry['value'] for entry in blkio if entry['op'].lower() == 'write')
+        }
+
+    def sample(self, stats, previous, current):
+        cpu = stats['cpu_stats']
+        precpu = stats['precpu_stats']
+        cpu_delta = cpu['cpu_usage']['total_usage'] - precpu['cpu_usage'].get('total_usage', 0)
+        system_delta = cpu.get('system_cpu_usage', 0) - precpu.get('system_cpu_usage', 0)
+        online = cpu.get('online_cpus') or len(cpu['cpu_usage'].get('percpu_usage') or [1])
+        memory = stats.get('memory_stats') or {}
+        details = memory.get('stats') or {}
+        cache = details.get('inactive_file', details.get('total_inactive_file', 0))
+        usage = memory.get('usage', 0) - cache
+        limit = memory.get('limit', 0)
+        elapsed = current['time'] - previous['time']
+        return {
+            'container': self.name,
+            'module': self.module,
+            'time': time.time(),
+            'cpu': cpu_delta / system_delta * online * 100 if system_delta > 0 else 0.0,
+            'memory': usage,
+            'limit': limit,
+            'memory_percent': usage / limit * 100 if limit else 0.0,
+            'rx_rate': (current['rx'] - previous['rx']) / elapsed,
+            'tx_rate': (current['tx'] - previous['tx']) / elapsed,
+            'read_rate': (current['read'] - previous['read']) / elapsed,
+            'write_rate': (current['write'] - previous['write']) / elapsed
+        }
+
+
+# render latest samples as table
+def table(collectors):
+    lines = [time.strftime('%Y-%m-%d %H:%M:%S'), f'{"CONTAINER":<24}{"CPU%":>8}{"MEM":>18}{"MEM%":>8}{"PEAK%":>8}{"NET RX/s":>10}{"NET TX/s":>10}{"BLK R/s":>10}{"BLK W/s":>10}']
+    for collector in collectors:
+        if not collector.samples:
+            lines.append(f'{collector.name:<24}{"waiting for samples":>20}')
+            continue
+        sample = collector.samples[-1]
+        peak = max(item['memory_percent'] for item in collector.samples)
+        lines.append(f"{collector.name:<24}{sample['cpu']:>8.1f}{size(sample['memory']) + ' / ' + size(sample['limit']):>18}{sample['memory_percent']:>8.1f}{peak:>8.1f}{size(sample['rx_rate']):>10}{size(sample['tx_rate']):>10}{size(sample['read_rate']):>10}{size(sample['write_rate']):>10}")
+    print('\033[2J\033[H' + '\n'.join(lines), flush=True)
+
+
+# monitor
+def monitor(names, interval=1.0, samples=60, ndjson=False):
+    collectors = [Collector(name, container, samples) for name, container in containers(names)]
+    if not collectors:
+        print('no running containers to monitor')
+        exit(1)
+    for collector in collectors: collector.start()
+    printed = {}
+    try:
+        while True:
+            time.sleep(interval)
+            if ndjson:
+                for collector in collectors:
+                    if collector.samples and collector.samples[-1]['time'] != printed.get(collector.name):
+                        printed[collector.name] = collector.samples[-1]['time']
+                        print(json.dumps(collector.samples[-1]), flush=True)
+            else: table(collectors)
+    except KeyboardInterrupt: pass
+
+
+#===============================================================================
+# Stack Exporter
+#===============================================================================
+# prometheus metrics of stack containers from one collector per container
+class Exporter(threading.Thread):
+
+    gauges = [
+        ('cpu_percent', lambda sample: sample['cpu'], 'CPU usage of container in percent of one core'),
+        ('memory_usage_bytes', lambda sample: sample['memory'], 'memory usage of container without page cache'),
+        ('memory_limit_bytes', lambda sample: sample['limit'], 'memory limit of container'),
+        ('memory_limit_ratio', lambda sample: sample['memory_percent'] / 100, 'memory usage of container over its limit'),
+        ('network_receive_bytes_per_second', lambda sample: sample['rx_rate'], 'network receive rate of container'),
+        ('network_transmit_bytes_per_second', lambda sample: sample['tx_rate'], 'network transmit rate of container'),
+        ('block_read_bytes_per_second', lambda sample: sample['read_rate'], 'block device read rate of container'),
+        ('block_write_bytes_per_second', lambda sample: sample['write_rate'], 'block device write rate of container')
+    ]
+
+    def __init__(self, names):
+        threading.Thread.__init__(self, daemon=True)
+        self.names = names
+        self.prefixes = {f"{configs[name]['default']['tenant']}-{configs[name]['default']['title']}": name for name in names}
+        self.lock = threading.Lock()
+        self.collectors = {}
+        self.states = {}
+        for name, container in containers(names, all=True): self.track(name, container)
+
+    def module(self, container_name):
+        for prefix, name in self.prefixes.items():
+            if container_name == prefix or container_name.startswith(f'{prefix}-'): return name
+
+    def track(self, name, container):
+        with self.lock:
+            self.states[container.name] = (name, container.attrs)
+            collector = self.collectors.get(container.name)
+            if container.status == 'running' and not (collector and collector.is_alive()):
+                collector = Collector(name, container, 2)
+                collector.start()
+                self.collectors[container.name] = collector
+
+    def run(self):
+        for event in client.events(decode=True, filters={'type': 'container'}):
+            container_name = event['Actor']['Attributes'].get('name', '')
+            name = self.module(container_name)
+            if not name: continue
+            if event['Action'] == 'destroy':
+                with self.lock:
+                    self.states.pop(container_name, None)
+                    self.collectors.pop(container_name, None)
+            elif event['Action'] in ['start', 'die', 'restart'] or event['Action'].startswith('health_status'):
+                try: self.track(name, client.containers.get(event['id']))
+                except docker.errors.NotFound: pass
+
+    def metrics(self):
+        lines = []
+        with self.lock:
+            states = dict(self.states)
+            collectors = dict(self.collectors)
+        labels = {}
+        for container_name, (name, attrs) in states.items():
+            labels[container_name] = f'tenant="{configs[name]["default"]["tenant"]}",module="{name}",container="{container_name}"'
+        lines += ['# HELP eqpls_container_up container is running', '# TYPE eqpls_container_up gauge']
+        for container_name, (name, attrs) in states.items():
+            lines.append(f'eqpls_container_up{{{labels[container_name]}}} {1 if attrs["State"]["Running"] else 0}')
+        lines += ['# HELP eqpls_container_health health status of container', '# TYPE eqpls_container_health gauge']
+        for container_name, (name, attrs) in states.items():
+            status = attrs['State']['Health']['Status'] if 'Health' in attrs['State'] else 'none'
+            lines.append(f'eqpls_container_health{{{labels[container_name]},status="{status}"}} 1')
+        lines += ['# HELP eqpls_container_restarts_total restarts of container by restart policy', '# TYPE eqpls_container_restarts_total counter']
+        for container_name, (name, attrs) in states.items():
+            lines.append(f'eqpls_container_restarts_total{{{labels[container_name]}}} {attrs.get("RestartCount", 0)}')
+        for metric, value, help in self.gauges:
+            lines += [f'# HELP eqpls_container_{metric} {help}', f'# TYPE eqpls_container_{metric} gauge']
+            for container_name, collector in collectors.items():
+                if container_name in labels and collector.is_alive() and collector.samples:
+                    lines.append(f'eqpls_container_{metric}{{{labels[container_name]}}} {value(collector.samples[-1])}')
+        return '\n'.join(lines) + '\n'
+
+
+# exporter
+def exporter(names, listen='127.0.0.1:9180'):
+    collector = Exporter(names)
+    collector.start()
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = collector.metrics().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args): pass
+
+    host, port = listen.rsplit(':', 1)
+    server = ThreadingHTTPServer((host, int(port)), Handler)
+    print(f'serve metrics on http://{listen}/metrics')
+    try: server.serve_forever()
+    except KeyboardInterrupt: pass
+
+
+#===============================================================================
+# Stack Logs
+#===============================================================================
+# log time option as relative duration (30s, 10m, 2h, 1d), unix time or iso format
+def timestamp(value):
+    if not value: return None
+    match = re.fullmatch(r'(\d+)([smhd])', value)
+    if match: return int(time.time()) - int(match.group(1)) * {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[match.group(2)]
+    if value.isdigit(): return int(value)
+    return datetime.fromisoformat(value)
+
+
+# timestamped log lines of container filtered by pattern
+def lines(container, pattern, **kwargs):
+    buffer = b''
+    for chunk in container.logs(stream=True, timestamps=True, **kwargs):
+        buffer += chunk
+        *complete, buffer = buffer.split(b'\n')
+        for line in complete:
+            stamp, _, text = line.decode('utf-8', 'replace').partition(' ')
+            if not pattern or pattern.search(text): yield (stamp, container.name, text)
+    if buffer:
+        stamp, _, text = buffer.decode('utf-8', 'replace').partition(' ')
+        if not pattern or pattern.search(text): yield (stamp, container.name, text)
+
+
+# merge followed log streams by timestamp within reorder window
+def interleave(streams, window=0.5, capacity=1024):
+    queue = Queue(maxsize=capacity)
+
+    def read(stream):
+        for entry in stream: queue.put(entry)
+
+    for stream in streams: threading.Thread(target=read, args=(stream,), daemon=True).start()
+    heap = []
+    while True:
+        try: heapq.heappush(heap, (queue.get(timeout=window), time.monotonic()))
+        except Empty: pass
+        while heap and (time.monotonic() - heap[0][1] >= window or len(heap) >= capacity): yield heapq.heappop(heap)[0]
+
+
+# logs
+def logs(names, follow=False, since=None, until=None, tail='100', grep=None):
+    pattern = re.compile(grep) if grep else None
+    options = {'follow': follow, 'since': timestamp(since), 'until': timestamp(until), 'tail': tail if tail == 'all' else int(tail)}
+    streams = [lines(container, pattern, **options) for _, container in containers(names, all=not follow)]
+    if not streams:
+        print('no containers to show logs')
+        exit(1)
+    try:
+        for stamp, name, text in (interleave(streams) if follow else heapq.merge(*streams)): print(f'{stamp} {name} | {text}', flush=follow)
+    except KeyboardInterrupt: pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-b', '--build', action='store_true', help='pull base images and build stack images in parallel')
+    parser.add_argument('-n', '--nocache', action='store_true', help='build images without cache')
+    parser.add_argument('-j', '--jobs', type=int, default=3, help='images built at the same time')
+    parser.add_argument('--save', metavar='FILE', help='save stack images into bundle file')
+    parser.add_argument('--load', metavar='FILE', help='load stack images from bundle file')
+    parser.add_argument('--level', type=int, default=6, help='gzip level of bundle file')
+    parser.add_argument('-d', '--deploy', action='store_true', help='deploy stack by waves of container links')
+    parser.add_argument('-s', '--start', action='store_true', help='start stack by waves of container links')
+    parser.add_argument('-r', '--restart', action='store_true', help='restart stack by waves of container links')
+    parser.add_argument('-t', '--stop', action='store_true', help='stop stack by reversed waves of container links')
+    parser.add_argument('-m', '--monitor', action='store_true', help='stream stats of stack containers')
+    parser.add_argument('--interval', type=float, default=1.0, help='monitor render interval in seconds')
+    parser.add_argument('--samples', type=int, default=60, help='monitor samples kept per container')
+    parser.add_argument('--json', action='store_true', help='monitor as newline delimited json')
+    parser.add_argument('-l', '--logs', action='store_true', help='show merged logs of stack containers')
+    parser.add_argument('-f', '--follow', action='store_true', help='follow logs')
+    parser.add_argument('--since', help='logs since relative duration (10m), unix time or iso time')
+    parser.add_argument('--until', help='logs until relative duration (10m), unix time or iso time')
+    parser.add_argument('--tail', default='100', help='lines from the end of each container logs or all')
+    parser.add_argument('--grep', help='regular expression filter of log lines')
+    parser.add_argument('-e', '--exporter', action='store_true', help='serve prometheus metrics of stack containers')
+    parser.add_argument('--listen', default='127.0.0.1:9180', help='exporter listen address')
+    parser.add_argument('-g', '--graph', action='store_true', help='show deploy waves of stack')
+    parser.add_argument('modules', nargs='*', help='modules of stack (default: all)')
+
+    args = parser.parse_args()
+    names = args.modules if args.modules else list(configs.keys())
+    for name in names:
+        if name not in configs:
+            print(f'unknown module : {name}')
+            exit(1)
+
+    if args.build: build(names, args.nocache, args.jobs)
+    elif args.save: bundle(names, args.save, args.level)
+    elif args.load: unbundle(args.load)
+    elif args.deploy: deploy(names)
+    elif args.start: start(names)
+    elif args.restart: restart(names)
+    elif args.stop: stop(names)
+    elif args.monitor: monitor(names, args.interval, args.samples, args.json)
+    elif args.logs: logs(names, args.follow, args.since, args.until, args.tail, args.grep)
+    elif args.exporter: exporter(names, args.listen)
+    elif args.graph: show(names)
+    else: parser.print_help()